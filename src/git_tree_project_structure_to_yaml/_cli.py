@@ -22,7 +22,9 @@ Typical usage examples:
 
 from __future__ import annotations
 
+import contextlib
 import logging
+import os
 import sys
 from pathlib import Path
 from typing import Annotated
@@ -31,9 +33,25 @@ import typer
 
 from .tree import build_tree_from_git
 from .types import OutputFormat
-from .utils import empty_list_if_none, generate_output_content, resolve_repo_paths
+from .utils import empty_list_if_none, open_output, resolve_repo_paths, write_output_content
 from .validators import validate_and_return_path, validate_and_return_repo, validate_directories
 
+# Common binary and build artifact extensions skipped by --exclude-binaries
+BINARY_EXCLUDE_PATTERNS = frozenset({
+    "*.a",
+    "*.bin",
+    "*.class",
+    "*.dll",
+    "*.dylib",
+    "*.exe",
+    "*.jpg",
+    "*.o",
+    "*.pdf",
+    "*.png",
+    "*.so",
+    "*.zip",
+})
+
 app = typer.Typer(pretty_exceptions_enable=True, help="Generate YAML or compact text from a Git repository")
 logger = logging.getLogger(__name__)
 
@@ -57,13 +75,36 @@ def main(
     exclude: Annotated[
         list[str] | None, typer.Option("-x", "--exclude", help="Patterns to exclude (can be used multiple times)")
     ] = None,
-    others: Annotated[bool, typer.Option("--others", help="Show untracked files in the output")] = True,
+    exclude_binaries: Annotated[
+        bool,
+        typer.Option(
+            "--exclude-binaries/--no-exclude-binaries",
+            help="Exclude tracked and untracked files with common binary extensions (images, archives, objects, libraries)",
+        ),
+    ] = False,
+    others: Annotated[bool, typer.Option("--others/--no-others", help="Show untracked files in the output")] = True,
     stage: Annotated[bool, typer.Option("--stage", help="Show staged files in the output")] = True,
     cached: Annotated[bool, typer.Option("--cached", help="Show cached/tracked files in the output")] = False,
     exclude_standard: Annotated[bool, typer.Option("--exclude-standard", help="Use standard Git exclusions")] = True,
     repo_as_root: Annotated[
         bool, typer.Option("--repo-as-root", help="Use the repository root as the root directory")
     ] = True,
+    use_cache: Annotated[
+        bool,
+        typer.Option(
+            "--cache/--no-cache", help="Cache listings of tracked files in the Git directory until the index changes"
+        ),
+    ] = True,
+    sparse: Annotated[
+        bool,
+        typer.Option(
+            "--sparse/--no-sparse",
+            help=(
+                "List directories outside a sparse-index checkout as single entries instead of every file in them"
+                " (needs Git 2.35 or newer)"
+            ),
+        ),
+    ] = False,
 ) -> None:
     """Generate YAML or compact text from Git repository structure.
 
@@ -78,13 +119,17 @@ def main(
 
     base_repo_path = validate_and_return_path(current_dir if repo_path is None else repo_path)
     git_repository = validate_and_return_repo(base_repo_path)
-    root_node = Path(Path(git_repository.git_dir).parent if repo_as_root else base_repo_path)
+    git_root = Path(git_repository.git_dir).parent
+    root_node = git_root if repo_as_root else base_repo_path
 
     repo_paths_list = empty_list_if_none(repo_paths)
     relative_repo_paths = resolve_repo_paths(repo_paths_list, root_node)
-    validate_directories(relative_repo_paths)
+    # Relative paths are relative to the root node, not to the current directory
+    validate_directories({root_node / path for path in relative_repo_paths})
 
     exclude_set = set(empty_list_if_none(exclude))
+    if exclude_binaries:
+        exclude_set |= BINARY_EXCLUDE_PATTERNS
     options_set = {
         opt
         for opt, flag in [
@@ -102,19 +147,29 @@ def main(
             root_node=root_node,
             directories=relative_repo_paths,
             exclude=exclude_set,
+            exclude_tracked=BINARY_EXCLUDE_PATTERNS if exclude_binaries else None,
             others=others,
             stage=stage,
             cached=cached,
             exclude_standard=exclude_standard,
+            use_cache=use_cache,
+            git_root=git_root,
+            sparse=sparse,
         )
 
-        output_content = generate_output_content(tree, output_format, options_set)
-
+        with open_output(output) as f:
+            write_output_content(tree, output_format, options_set, f)
         if output:
-            with open(output, "w", encoding="utf-8") as f:
-                f.write(output_content)
             logger.info("Output written to %s", output)
 
+    except BrokenPipeError:
+        # The reader went away, e.g. piped into head; stop quietly like other command-line tools.
+        # Point stdout at devnull so the interpreter's final flush does not fail again.
+        with contextlib.suppress(AttributeError, OSError, ValueError):
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+            os.close(devnull)
+        raise typer.Exit(code=1) from None
     except Exception as e:
         logger.exception("An error occurred: %s", e)
         raise typer.Exit(code=1) from None
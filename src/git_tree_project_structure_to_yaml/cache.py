@@ -0,0 +1,112 @@
+"""On-disk cache for git ls-files listings of the index."""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_NAME = "git-tree-structure-cache"
+
+# The index ends with a checksum of its contents: 20 bytes for SHA-1 repositories, 32 for SHA-256
+INDEX_CHECKSUM_SIZE = 32
+
+
+def ls_files_cache_path(git_dir: Path, work_tree: Path, args: list[str]) -> Path | None:
+    """Return the cache file for a git ls-files listing, or None if it cannot be cached.
+
+    A listing of tracked files only depends on the index, so the index together
+    with the ls-files arguments identifies the listing. The index is identified
+    by its modification time, its size and the checksum git stores at its end:
+    two rewrites can land within one timestamp tick and keep the same size
+    (e.g. ``git mv a.txt b.txt``), but not the same checksum. With
+    ``index.skipHash`` (enabled by ``feature.manyFiles``) git writes a zeroed
+    checksum, and the key falls back to the modification time and size alone.
+    Untracked files
+    (``--others``) and submodules are not covered by the index, so those
+    listings are never cached.
+
+    Cache files are named ``<index mtime>-<index size>-<index checksum>-<args digest>``
+    inside ``<git dir>/git-tree-structure-cache``.
+
+    Args:
+        git_dir: Path to the repository's git directory
+        work_tree: Path to the repository's working tree
+        args: Arguments passed to git ls-files
+
+    Returns:
+        Path | None: Path of the cache file, or None if the listing cannot be cached
+    """
+    if "--others" in args or (work_tree / ".gitmodules").exists():
+        return None
+    try:
+        with (git_dir / "index").open("rb") as index_file:
+            index_stat = os.fstat(index_file.fileno())
+            index_file.seek(max(index_stat.st_size - INDEX_CHECKSUM_SIZE, 0))
+            index_checksum = index_file.read().hex()
+    except FileNotFoundError:
+        return None
+    args_digest = hashlib.blake2b("\0".join(args).encode(), digest_size=16).hexdigest()
+    index_key = f"{index_stat.st_mtime_ns}-{index_stat.st_size}-{index_checksum}"
+    return git_dir / CACHE_DIR_NAME / f"{index_key}-{args_digest}"
+
+
+def prune_stale_entries(cache_path: Path) -> None:
+    """Remove cache files that were written for a different version of the index.
+
+    Entries for other ls-files arguments against the current index are kept.
+
+    Args:
+        cache_path: Cache file that was just written
+    """
+    index_prefix = cache_path.name.rsplit("-", 1)[0] + "-"
+    for entry in cache_path.parent.iterdir():
+        if not entry.name.startswith(index_prefix):
+            logger.debug("Removing stale ls-files cache entry: %s", entry)
+            entry.unlink(missing_ok=True)
+
+
+@contextmanager
+def cache_writer(cache_path: Path | None) -> Iterator[BinaryIO | None]:
+    """Open a temporary file that becomes the cache file for *cache_path* on success.
+
+    The listing is written to a temporary file next to the cache file and only
+    renamed into place when the block exits without an exception, so readers
+    never see a partial listing. Caching is best effort: if the cache directory
+    cannot be written, None is yielded and the listing is simply not cached.
+
+    Args:
+        cache_path: Final location of the cache file, or None to disable caching
+
+    Yields:
+        BinaryIO | None: File to write the raw listing to, or None if it is not cached
+    """
+    sink: BinaryIO | None = None
+    if cache_path is not None:
+        temp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        try:
+            cache_path.parent.mkdir(exist_ok=True)
+            sink = temp_path.open("wb")
+        except OSError as e:
+            logger.debug("Not caching ls-files listing: %s", e)
+    if cache_path is None or sink is None:
+        yield None
+        return
+
+    try:
+        with sink:
+            yield sink
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    try:
+        os.replace(temp_path, cache_path)
+        prune_stale_entries(cache_path)
+    except OSError as e:
+        logger.debug("Could not store ls-files cache entry %s: %s", cache_path, e)
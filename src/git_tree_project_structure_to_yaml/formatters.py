@@ -2,12 +2,37 @@
 
 from __future__ import annotations
 
+from collections.abc import Iterator
+from functools import lru_cache
 from pathlib import Path
-
-from nutree import Node, Tree
+from typing import TYPE_CHECKING
 
 from .types import IndentType
 
+if TYPE_CHECKING:
+    from nutree import Node, Tree
+
+
+def node_is_dir(node: Node[Path]) -> bool:
+    """Return whether a node represents a directory.
+
+    Trees built by ``build_tree_from_git`` record this in the node's ``is_dir``
+    meta value when the node is added, so no filesystem access is needed. Nodes
+    without that value fall back to ``Path.is_dir()`` once and store the result
+    in their meta, so later formatter calls for the same node do not stat again.
+
+    Args:
+        node: Node containing a Path object
+
+    Returns:
+        bool: True if the node represents a directory
+    """
+    is_dir = node.get_meta("is_dir")
+    if is_dir is None:
+        is_dir = node.data.is_dir()
+        node.set_meta("is_dir", is_dir)
+    return is_dir
+
 
 def path_node_formatter(node: Node[Path]) -> str:
     """Format a Path node for display in the tree format output.
@@ -21,20 +46,23 @@ def path_node_formatter(node: Node[Path]) -> str:
     Returns:
         str: Formatted string with appropriate directory indicator (trailing slash for directories)
     """
-    path = node.data
-    display_name = path.absolute().name if not path.name else path.name
+    # Only relative paths such as Path(".") have no name of their own; resolving
+    # those against the working directory is the sole case that needs a syscall.
+    display_name = node.data.name or node.data.absolute().name
 
     # Add trailing slash for directories
-    return f"{display_name}/" if path.is_dir() else display_name
+    return f"{display_name}/" if node_is_dir(node) else display_name
 
 
+@lru_cache(maxsize=256)
 def indent_string(
     string: str, indent_count: int = 0, indent_width: int = 2, indent_type: IndentType = IndentType.SPACES
 ) -> str:
     """Indent a string with a specified number of spaces or tabs.
 
     Adds indentation to the beginning of a string using either spaces or tabs,
-    based on the specified indentation type and count.
+    based on the specified indentation type and count. Results are memoized,
+    since a tree only ever needs one indentation per depth.
 
     Args:
         string: The string to indent
@@ -82,7 +110,7 @@ def get_suffix(node: Node[Path]) -> str:
     Returns:
         str: The suffix string (":" for directories, "" for files)
     """
-    return ":" if node.data.is_dir() else ""
+    return ":" if node_is_dir(node) else ""
 
 
 def get_prefix(node: Node[Path], indent_width: int = 2, indent_type: IndentType = IndentType.SPACES) -> str:
@@ -121,6 +149,18 @@ def yaml_formatter(node: Node[Path]) -> str:
     return f"{prefix}{name}{suffix}"
 
 
+def iter_tree_lines(tree: Tree[Path]) -> Iterator[str]:
+    """Yield the lines of the tree format output one at a time.
+
+    Args:
+        tree: Tree object representing the repository structure
+
+    Yields:
+        str: One line of the tree representation, without a line terminator
+    """
+    return tree.format_iter(style="lines32", repr=path_node_formatter, title=False)
+
+
 def generate_tree_structure(tree: Tree[Path]) -> str:
     """Generate a text representation of the directory structure similar to the Unix 'tree' command.
 
@@ -134,11 +174,38 @@ def generate_tree_structure(tree: Tree[Path]) -> str:
     Returns:
         str: String containing the tree representation with ASCII/Unicode branch characters
     """
-    return tree.format(style="lines32", repr=path_node_formatter, title=False)
+    return "\n".join(iter_tree_lines(tree))
+
+
+def iter_yaml_lines(tree: Tree[Path]) -> Iterator[str]:
+    """Yield the lines of the YAML output one at a time.
+
+    The tree is walked in pre-order with an explicit stack of ``(node, depth)``
+    pairs, so each node's depth is handed down from its parent instead of being
+    recomputed from the parent chain. The indentation prefix for each depth is
+    built the first time that depth is reached and reused for every later node
+    at the same depth, leaving a list lookup per node.
+
+    Args:
+        tree: Tree object representing the repository structure
+
+    Yields:
+        str: One line of the YAML representation, without a line terminator
+    """
+    prefixes: list[str] = []
+    # Children are pushed in reverse so they are popped in their original order
+    stack: list[tuple[Node[Path], int]] = [(node, 0) for node in reversed(tree.children)]
+    while stack:
+        node, depth = stack.pop()
+        if depth == len(prefixes):
+            # A node is at most one level below the deepest node seen so far
+            prefixes.append(indent_string("- ", depth))
+        yield f"{prefixes[depth]}{path_node_formatter(node)}{get_suffix(node)}"
+        stack.extend((child, depth + 1) for child in reversed(node.children))
 
 
 def generate_yaml_output(tree: Tree[Path]) -> str:
-    """Generate YAML output from the tree structure using nutree's native formatter.
+    """Generate YAML output from the tree structure.
 
     Creates a YAML representation of the tree structure, with proper indentation
     and formatting to represent the hierarchical structure of files and directories.
@@ -150,4 +217,4 @@ def generate_yaml_output(tree: Tree[Path]) -> str:
     Returns:
         str: String containing YAML representation of the tree
     """
-    return tree.format(repr=yaml_formatter, title=False, style="list")
+    return "\n".join(iter_yaml_lines(tree))
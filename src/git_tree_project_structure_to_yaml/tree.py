@@ -2,75 +2,256 @@
 
 from __future__ import annotations
 
+import fnmatch
 import logging
+import os
+import re
+import subprocess
+import tempfile
+from collections.abc import Iterable, Iterator
+from functools import partial
+from operator import attrgetter
 from pathlib import Path
+from typing import IO, TYPE_CHECKING
 
 import typer
-from git import Repo
-from nutree import Tree
+
+from .cache import cache_writer, ls_files_cache_path
+
+if TYPE_CHECKING:
+    from git import Repo
+    from nutree import Node, Tree
 
 logger = logging.getLogger(__name__)
 
+# Size of the reads from git ls-files' stdout
+LS_FILES_READ_SIZE = 64 * 1024
+
+# --stage prefixes index entries with "<mode> <object> <stage>\t"; untracked files listed by --others are not
+STAGE_RECORD_PREFIX = re.compile(rb"([0-7]{6}) [0-9a-f]+ [0-3]\t")
 
-def git_lsfiles_to_path_list(repo: Repo, *args: str) -> list[Path]:
-    """Convert Git ls-files output to a list of Path objects.
+# Index entry modes that stand for a directory: a sparse directory entry and a submodule (gitlink)
+SPARSE_DIRECTORY_MODE = 0o040000
+DIRECTORY_MODES = frozenset({SPARSE_DIRECTORY_MODE, 0o160000})
 
-    Executes the git ls-files command with the provided arguments and converts
-    the output into a list of absolute Path objects relative to the repository root.
+
+def iter_ls_files_records(stream: IO[bytes], sink: IO[bytes] | None = None) -> Iterator[bytes]:
+    """Split NUL-terminated ``git ls-files -z`` output into records.
+
+    The stream is read in chunks, so records are yielded while git is still
+    writing and the full listing is never held in memory at once.
 
     Args:
-        repo: GitPython Repo object representing the Git repository
-        *args: Additional arguments to pass to git ls-files command
+        stream: Binary stream of ls-files output
+        sink: Optional binary file that receives a verbatim copy of the output
+
+    Yields:
+        bytes: One ls-files record without its terminating NUL byte
+    """
+    pending = b""
+    for chunk in iter(partial(stream.read, LS_FILES_READ_SIZE), b""):
+        if sink is not None:
+            sink.write(chunk)
+        *records, pending = (pending + chunk).split(b"\0")
+        yield from records
+
+
+def parse_ls_files_record(record: bytes, staged: bool) -> tuple[tuple[str, ...], int | None]:
+    """Split one ``git ls-files -z`` record into path components and index mode.
+
+    Args:
+        record: One ls-files record without its terminating NUL byte
+        staged: Whether ls-files was run with ``--stage``
 
     Returns:
-        list[Path]: List of Path objects representing files in the repository
+        tuple[tuple[str, ...], int | None]: Path components relative to the repository
+        root, and the entry's mode for index entries listed with ``--stage`` or for sparse
+        directory entries (None otherwise)
+    """
+    mode = None
+    if staged and (prefix := STAGE_RECORD_PREFIX.match(record)):
+        mode = int(prefix[1], 8)
+        record = record[prefix.end() :]
+    if record.endswith(b"/"):
+        # With --sparse, directories outside the sparse-checkout cone are listed as a single "dir/" entry
+        mode = SPARSE_DIRECTORY_MODE
+        record = record[:-1]
+    return tuple(os.fsdecode(record).split("/")), mode
+
+
+def git_lsfiles_to_parts(
+    git_dir: Path, git_root: Path, *args: str, use_cache: bool = False
+) -> Iterator[tuple[tuple[str, ...], int | None]]:
+    """Yield the path components and index mode of every file listed by Git ls-files.
+
+    Executes the git ls-files command with the provided arguments and splits
+    every listed path into its components. Git always reports paths relative
+    to the repository root with ``/`` separators, so no Path objects are
+    needed to take them apart.
+
+    git is run directly rather than through GitPython's command wrapper, with
+    ``-z`` so paths are NUL-terminated and never quoted. Its stderr goes to a
+    temporary file rather than a pipe, so git cannot block on a full stderr
+    pipe while its stdout is still being read.
+
+    With *use_cache*, listings that only depend on the index are stored in the
+    git directory and replayed on later runs until the index changes, without
+    running git at all (see ``ls_files_cache_path``).
+
+    Args:
+        git_dir: Path to the repository's git directory
+        git_root: Path to the repository root, where git is run
+        *args: Additional arguments to pass to git ls-files command
+        use_cache: Whether to read and write the on-disk listing cache (default: False)
+
+    Yields:
+        tuple[tuple[str, ...], int | None]: Path components of a file, relative to the
+        repository root, and its mode if it was listed from the index with ``--stage``
 
     Raises:
         typer.Exit: If the Git command fails for any reason
     """
-    root_path = Path(repo.git_dir).parent
+    staged = "--stage" in args
+
+    cache_path = ls_files_cache_path(git_dir, git_root, list(args)) if use_cache else None
+    if cache_path is not None and cache_path.is_file():
+        logger.debug("Using cached ls-files listing: %s", cache_path)
+        with cache_path.open("rb") as cached_listing:
+            for record in iter_ls_files_records(cached_listing):
+                yield parse_ls_files_record(record, staged)
+        return
+
+    command = ["git", "-C", str(git_root), "ls-files", "-z", *args]
     try:
-        return [root_path / line.rsplit("\t", 1)[-1] for line in repo.git.ls_files(*args).splitlines()]
-    except Exception as e:
+        with (
+            cache_writer(cache_path) as sink,
+            tempfile.TemporaryFile() as stderr_file,
+            subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file) as process,
+        ):
+            for record in iter_ls_files_records(process.stdout, sink):  # type: ignore[arg-type]
+                yield parse_ls_files_record(record, staged)
+            if process.wait():
+                stderr_file.seek(0)
+                typer.echo(f"Git command failed: {os.fsdecode(stderr_file.read()).strip()}", err=True)
+                raise typer.Exit(code=1)
+    except OSError as e:
         typer.echo(f"Git command failed: {e}", err=True)
         raise typer.Exit(code=1) from e
 
 
-def add_path_to_tree(tree: Tree[Path], path: Path, root: Path) -> None:
-    """Add *path* to *tree* without duplicating existing nodes.
+def add_path_to_tree(
+    tree: Tree[Path],
+    parts: tuple[str, ...],
+    root: Path,
+    index: dict[tuple[str, ...], Node[Path]],
+    *,
+    is_dir: bool = False,
+) -> None:
+    """Add the path made of *parts* below *root* to *tree* without duplicating existing nodes.
 
-    Important: ``next(gen, default)`` evaluates *default* eagerly, so we must
-    **not** pass ``cursor_node.add`` as that default or we risk creating the
-    node even when it already exists. Instead we search, then add only if
-    nothing was found.
+    Existing nodes are looked up in *index*, which maps the components of every
+    path already in the tree (relative to *root*, so *root* itself is ``()``)
+    to its node. Each path component costs a single dict lookup instead of a
+    scan over the parent's children, and a Path object is only built when a
+    new node is created. A path that is already present is skipped with a
+    single lookup. Pass the same *index* for every call against the same tree.
+
+    Every new node records whether it is a directory in its ``is_dir`` meta
+    value: the root and intermediate components are directories, the last
+    component is whatever *is_dir* says. Formatters read that value instead of
+    querying the filesystem.
+
+    Args:
+        tree: Tree to add the path to
+        parts: Components of the path to add, relative to *root*
+        root: Top-level directory node the path is attached to
+        index: Mapping of path components to the nodes already present in *tree*
+        is_dir: Whether the path itself is a directory (default: False)
     """
-    root_node = next((n for n in tree.children if n.data == root), None)
-    if root_node is None:
-        root_node = tree.add(root)
+    if parts in index:
+        # Already present, e.g. an unmerged path that git lists once per stage
+        return
 
-    cursor_node = root_node
-    cursor_path = root
+    cursor_node = index.get(())
+    if cursor_node is None:
+        cursor_node = index[()] = tree.add(root)
+        cursor_node.set_meta("is_dir", True)
 
-    for part in path.relative_to(root).parts:
-        cursor_path /= part
-        child = next((n for n in cursor_node.children if n.data == cursor_path), None)
+    last = len(parts)
+    for depth in range(1, last + 1):
+        key = parts[:depth]
+        child = index.get(key)
         if child is None:
-            child = cursor_node.add(cursor_path)
+            child = index[key] = cursor_node.add(cursor_node.data / parts[depth - 1])
+            child.set_meta("is_dir", is_dir or depth < last)
         cursor_node = child
 
 
+def is_dir_on_disk(
+    root: Path, parts: tuple[str, ...], listings: dict[tuple[str, ...], dict[str, os.DirEntry[str]]]
+) -> bool:
+    """Return whether the path made of *parts* below *root* is a directory in the working tree.
+
+    git lists submodules as a single entry, which is a directory on disk even
+    though nothing below it is listed. Rather than stat'ing every path, the
+    parent directory is read once with ``os.scandir`` and its entries are
+    kept in *listings*, so every sibling is answered from the same directory
+    read. Symbolic links are not followed: git tracks a link to a directory
+    as a link, not as a directory. Pass the same *listings* for every call
+    against the same working tree.
+
+    Args:
+        root: Repository root the path is relative to
+        parts: Components of the path, relative to *root*
+        listings: Directory entries already read, keyed by the components of their directory
+
+    Returns:
+        bool: True if the path exists and is a directory
+    """
+    parent = parts[:-1]
+    entries = listings.get(parent)
+    if entries is None:
+        try:
+            with os.scandir(os.path.join(root, *parent)) as scan:
+                entries = {entry.name: entry for entry in scan}
+        except OSError:
+            # Deleted or unreadable, e.g. a path that is staged but no longer on disk
+            entries = {}
+        listings[parent] = entries
+    entry = entries.get(parts[-1])
+    return entry is not None and entry.is_dir(follow_symlinks=False)
+
+
 def build_ls_files_args(
-    directory: Path, exclude: set[str], others: bool, stage: bool, cached: bool, exclude_standard: bool
+    directories: Iterable[Path],
+    exclude: set[str],
+    others: bool,
+    stage: bool,
+    cached: bool,
+    exclude_standard: bool,
+    sparse: bool = False,
 ) -> list[str]:
     """Build arguments for git ls-files command.
 
+    All directories are passed as pathspecs after ``--`` so a single git
+    ls-files call lists every requested directory.
+
+    ``--stage`` and ``--cached`` list the same index entries, so only one of
+    them is passed; passing both would make git do the work twice for no extra
+    paths. ``--stage`` is preferred because the mode it reports tells
+    directories (submodules) apart without touching the filesystem.
+    ``--exclude-standard`` only filters untracked files and is dropped unless
+    ``--others`` is requested. Likewise ``--sparse`` only affects index
+    entries and is dropped unless the index is listed.
+
     Args:
-        directory: Directory to list files from
+        directories: Directories to list files from
         exclude: Set of patterns to exclude
         others: Whether to include untracked files
         stage: Whether to include staged files
         cached: Whether to include cached files
         exclude_standard: Whether to use standard Git exclusions
+        sparse: Whether to list directories outside a sparse index as single entries (default: False)
 
     Returns:
         list[str]: Arguments for git ls-files command
@@ -78,17 +259,21 @@ def build_ls_files_args(
     ls_files_args: list[str] = []
     if others:
         ls_files_args.append("--others")
+        if exclude_standard:
+            ls_files_args.append("--exclude-standard")
     if stage:
         ls_files_args.append("--stage")
-    if cached:
+    elif cached:
         ls_files_args.append("--cached")
-    if exclude_standard:
-        ls_files_args.append("--exclude-standard")
-    for exclude_pattern in exclude:
+    if sparse and (stage or cached):
+        ls_files_args.append("--sparse")
+    for exclude_pattern in sorted(exclude):
         ls_files_args.append(f"--exclude={exclude_pattern}")
     if not others:
         ls_files_args.append("--recurse-submodules")
-    ls_files_args.append(str(directory))
+    # "--" keeps git from reading a directory named like an option as one
+    ls_files_args.append("--")
+    ls_files_args.extend(str(directory) for directory in directories)
     return ls_files_args
 
 
@@ -101,6 +286,10 @@ def build_tree_from_git(
     stage: bool = True,
     cached: bool = False,
     exclude_standard: bool = True,
+    use_cache: bool = False,
+    git_root: Path | None = None,
+    sparse: bool = False,
+    exclude_tracked: Iterable[str] | None = None,
 ) -> Tree[Path]:
     """Build a tree structure from Git repository using GitPython and nutree.
 
@@ -108,6 +297,13 @@ def build_tree_from_git(
     with filtering options for different Git file states (staged, cached, untracked) and
     pattern exclusions.
 
+    The entries of every directory are sorted by name, so the output does not
+    depend on the order in which git lists tracked and untracked files.
+
+    git only applies *exclude* to untracked files. Files whose name matches one
+    of the *exclude_tracked* shell patterns are left out whether they are
+    tracked or not.
+
     Args:
         repo: GitPython Repo object representing the Git repository
         root_node: Path object representing the root directory for the tree
@@ -117,12 +313,17 @@ def build_tree_from_git(
         stage: Whether to include staged files in the output (default: True)
         cached: Whether to include cached files in the output (default: False)
         exclude_standard: Whether to use standard Git exclusions (default: True)
+        use_cache: Whether to cache listings of tracked files in the git directory (default: False)
+        git_root: Path to the repository root, if the caller already has it (default: derived from *repo*)
+        sparse: Whether to list directories outside a sparse index as single entries (default: False)
+        exclude_tracked: Optional file name patterns to exclude from tracked files as well
 
     Returns:
         Tree[Path]: Tree object representing the repository structure
     """
     exclude = exclude or set()
-    git_root_path = Path(repo.git_dir).parent
+    git_dir = Path(repo.git_dir)
+    git_root_path = git_dir.parent if git_root is None else git_root
     logger.debug("Git root path: %s", git_root_path)
     logger.debug("Root node: %s", root_node)
 
@@ -131,14 +332,42 @@ def build_tree_from_git(
         relative_root = relative_root.absolute()
     root_dir_name = relative_root.name
 
+    # Imported here so that --help and argument errors do not pay for loading nutree
+    from nutree import Tree
+
     tree: Tree[Path] = Tree(f"# Directory Tree for {root_dir_name}")
+    path_to_node: dict[tuple[str, ...], Node[Path]] = {}
+    directory_listings: dict[tuple[str, ...], dict[str, os.DirEntry[str]]] = {}
+
+    # Resolve against the root node so the directories land at their place in
+    # the repository tree and git sees the same paths regardless of its cwd.
+    absolute_directories = sorted(root_node / directory for directory in directories)
+    with tree:
+        for directory in absolute_directories:
+            add_path_to_tree(tree, directory.relative_to(git_root_path).parts, git_root_path, path_to_node, is_dir=True)
+
+        ls_files_args = build_ls_files_args(
+            absolute_directories, exclude, others, stage, cached, exclude_standard, sparse
+        )
+        # Checked once rather than by logger.debug() for every listed file
+        log_files = logger.isEnabledFor(logging.DEBUG)
+        # All patterns folded into one regular expression, matched against each listed file's name
+        excluded_name = (
+            re.compile("|".join(fnmatch.translate(pattern) for pattern in sorted(exclude_tracked))).match
+            if exclude_tracked
+            else None
+        )
+        for parts, mode in git_lsfiles_to_parts(git_dir, git_root_path, *ls_files_args, use_cache=use_cache):
+            if log_files:
+                logger.debug("Processing file: %s", parts)
+            if excluded_name is not None and mode not in DIRECTORY_MODES and excluded_name(parts[-1]):
+                continue
+            if mode is None:
+                is_dir = is_dir_on_disk(git_root_path, parts, directory_listings)
+            else:
+                is_dir = mode in DIRECTORY_MODES
+            add_path_to_tree(tree, parts, git_root_path, path_to_node, is_dir=is_dir)
 
-    for directory in directories:
-        tree.add(directory.absolute())
-        ls_files_args = build_ls_files_args(directory, exclude, others, stage, cached, exclude_standard)
-        file_list = git_lsfiles_to_path_list(repo, *ls_files_args)
-        with tree:
-            for file_path in file_list:
-                logger.debug("Processing %s: %s", "directory" if file_path.is_dir() else "file", file_path)
-                add_path_to_tree(tree, file_path, git_root_path)
+        # git lists untracked files before tracked ones; sort every directory's entries by name once at the end
+        tree.sort(key=attrgetter("data.name"))
     return tree
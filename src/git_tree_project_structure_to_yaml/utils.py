@@ -2,19 +2,27 @@
 
 from __future__ import annotations
 
+import io
 import logging
+import sys
+from collections.abc import Iterator
+from contextlib import contextmanager
 from pathlib import Path
-from typing import TypeVar
+from typing import TYPE_CHECKING, TextIO, TypeVar
 
-from nutree import Tree
-
-from .formatters import generate_tree_structure, generate_yaml_output
+from .formatters import generate_tree_structure, generate_yaml_output, iter_tree_lines, iter_yaml_lines
 from .types import OutputFormat
 
+if TYPE_CHECKING:
+    from nutree import Tree
+
 logger = logging.getLogger(__name__)
 
 T = TypeVar("T")
 
+# Output is written line by line; a large buffer turns that into few write syscalls
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+
 
 def empty_list_if_none[T](value: list[T] | None) -> list[T]:
     """Return an empty list if the input value is None, otherwise return the input value.
@@ -49,17 +57,31 @@ def resolve_repo_paths(repo_paths: list[Path], root_node: Path) -> set[Path]:
     for path in repo_paths:
         path_obj = Path(path)
         logger.debug("Processing path: %s", path_obj)
-        try:
+        # Checked up front so the common case does not raise and catch a ValueError
+        if path_obj.is_relative_to(root_node):
             rel_path = path_obj.relative_to(root_node)
             logger.debug("Successfully made relative: %s", rel_path)
             relative_repo_paths.add(rel_path)
-        except ValueError as e:
-            logger.exception("Error making path relative: %s - %s", path_obj, e)
+        else:
+            logger.error("Error making path relative: %s is not in the subpath of %s", path_obj, root_node)
             logger.debug("Using original path instead: %s", path_obj)
             relative_repo_paths.add(path_obj)
     return relative_repo_paths
 
 
+def nothing_found_message(options_set: set[str]) -> str:
+    """Return the YAML comment written when the tree has no entries.
+
+    Args:
+        options_set: Set of options used for the message when no files found
+
+    Returns:
+        str: YAML comment line, including its line terminator
+    """
+    logger.info("No matching files found in the repository with the specified options")
+    return f"# Nothing found that matched the specified options: {options_set}\n"
+
+
 def generate_output_content(tree: Tree[Path], output_format: OutputFormat, options_set: set[str]) -> str:
     """Generate output content based on the requested format.
 
@@ -71,10 +93,67 @@ def generate_output_content(tree: Tree[Path], output_format: OutputFormat, optio
     Returns:
         str: Generated output content
     """
+    if not tree.count:
+        return nothing_found_message(options_set) if output_format == OutputFormat.YAML else ""
     if output_format == OutputFormat.YAML:
-        yaml_content = generate_yaml_output(tree)
-        if yaml_content:
-            return yaml_content
-        logger.info("No matching files found in the repository with the specified options")
-        return f"# Nothing found that matched the specified options: {options_set}\n"
+        return generate_yaml_output(tree)
     return generate_tree_structure(tree)
+
+
+def write_output_content(tree: Tree[Path], output_format: OutputFormat, options_set: set[str], file: TextIO) -> None:
+    """Write output in the requested format to a file, one line at a time.
+
+    Unlike ``generate_output_content`` the whole document is never held in
+    memory; each line is written as soon as it is formatted and terminated
+    with a newline.
+
+    Args:
+        tree: Tree object representing the repository structure
+        output_format: Output format (yaml or tree)
+        options_set: Set of options used for the message when no files found
+        file: Text stream to write the output to
+    """
+    lines = iter_yaml_lines(tree) if output_format == OutputFormat.YAML else iter_tree_lines(tree)
+    first_line = next(lines, None)
+    if first_line is None:
+        if output_format == OutputFormat.YAML:
+            file.write(nothing_found_message(options_set))
+        return
+    file.write(f"{first_line}\n")
+    for line in lines:
+        file.write(f"{line}\n")
+
+
+@contextmanager
+def open_output(output: Path | None) -> Iterator[TextIO]:
+    """Open the output file, or standard output, for writing with a large buffer.
+
+    Standard output is reopened on its file descriptor with ``OUTPUT_BUFFER_SIZE``
+    bytes of buffering and the same encoding, and flushed (not closed) on exit.
+    A terminal keeps the usual line-buffered standard output, so lines show up
+    as they are written. When it has no file descriptor, e.g. while captured by
+    a test runner, it is used as is.
+
+    Args:
+        output: Output file, or None for standard output
+
+    Yields:
+        TextIO: Text stream to write the output to
+    """
+    if output is not None:
+        with open(output, "w", encoding="utf-8", buffering=OUTPUT_BUFFER_SIZE) as f:
+            yield f
+        return
+
+    try:
+        fd = sys.stdout.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        fd = None
+    if fd is None or sys.stdout.isatty():
+        yield sys.stdout
+        return
+    sys.stdout.flush()
+    with open(
+        fd, "w", encoding=sys.stdout.encoding, errors=sys.stdout.errors, buffering=OUTPUT_BUFFER_SIZE, closefd=False
+    ) as f:
+        yield f
@@ -4,10 +4,12 @@ from __future__ import annotations
 
 import logging
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import typer
-from git import Repo
-from git.exc import InvalidGitRepositoryError, NoSuchPathError
+
+if TYPE_CHECKING:
+    from git import Repo
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +30,10 @@ def validate_and_return_repo(path: Path) -> Repo:
     Raises:
         typer.Exit: If the path is not a valid Git repository or does not exist
     """
+    # GitPython is slow to import, so it is only loaded once a repository is needed
+    from git import Repo
+    from git.exc import InvalidGitRepositoryError, NoSuchPathError
+
     try:
         return Repo(path, search_parent_directories=True)
     except InvalidGitRepositoryError as e:
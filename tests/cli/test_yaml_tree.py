@@ -1,50 +1,95 @@
 from __future__ import annotations
 
-from pathlib import Path
-from typing import Any
-from unittest.mock import MagicMock
+import io
+import os
+import re
+import subprocess
+import sys
+from collections.abc import Iterator
+from pathlib import Path, PurePosixPath
+from typing import Any, ClassVar
 
 import pytest
 import typer
 import yaml
-from nutree import Tree
+from git import Git, Repo
+from nutree import Node, Tree
+from typer.testing import CliRunner
 
-from git_tree_project_structure_to_yaml._cli import main
+from git_tree_project_structure_to_yaml._cli import app, main
+from git_tree_project_structure_to_yaml.cache import CACHE_DIR_NAME, ls_files_cache_path
 from git_tree_project_structure_to_yaml.formatters import generate_yaml_output, indent_string, path_node_formatter
 from git_tree_project_structure_to_yaml.tree import (
     add_path_to_tree,
     build_ls_files_args,
     build_tree_from_git,
-    git_lsfiles_to_path_list,
+    git_lsfiles_to_parts,
+    is_dir_on_disk,
 )
 from git_tree_project_structure_to_yaml.types import IndentType, OutputFormat
-from git_tree_project_structure_to_yaml.utils import empty_list_if_none, generate_output_content, resolve_repo_paths
+from git_tree_project_structure_to_yaml.utils import (
+    empty_list_if_none,
+    generate_output_content,
+    open_output,
+    resolve_repo_paths,
+    write_output_content,
+)
 from git_tree_project_structure_to_yaml.validators import (
     validate_and_return_path,
     validate_and_return_repo,
     validate_directories,
 )
 
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as YamlLoader  # type: ignore[assignment]
+
+
+class FakePath(PurePosixPath):
+    """Pure path whose is_dir() answers from a fixed set of directory names instead of the filesystem."""
+
+    dir_names: ClassVar[frozenset[str]] = frozenset()
+
+    def is_dir(self) -> bool:
+        return self.name in self.dir_names
+
+
+def fake_path_cls(dir_names: set[str]) -> type[FakePath]:
+    """Create a FakePath subclass that treats the given names as directories."""
+    return type("FakePath", (FakePath,), {"dir_names": frozenset(dir_names)})
 
-@pytest.fixture
-def mock_path_is_dir():
-    """Fixture that allows mocking Path.is_dir() method in tests."""
 
-    def _mock_factory(dir_names: set[str]):
-        """Create a mock is_dir method that identifies specific paths as directories."""
+@pytest.fixture(scope="module")
+def basic_tree() -> Tree[Path]:
+    """Build a root directory holding file1.txt and file2.md once for the module's read-only tests."""
+    fake_path = fake_path_cls({"root"})
+    tree = Tree[Path]("Test Tree")
+    root = tree.add(fake_path("root"))
+    root.add(fake_path("file1.txt"))
+    root.add(fake_path("file2.md"))
+    return tree
 
-        def _mock_is_dir(self):
-            return self.name in dir_names
 
-        return _mock_is_dir
+@pytest.fixture(scope="module")
+def basic_yaml(basic_tree) -> str:
+    """Serialize the basic tree to YAML once for the module's read-only tests."""
+    return generate_yaml_output(basic_tree)
 
-    return _mock_factory
+
+# Gitlink entries only record a commit id; git never looks the submodule commit up in the superproject
+SUBMODULE_COMMIT = "1" * 40
+
+
+def init_repo(path: Path) -> Repo:
+    """Create an empty git repository at path with main as its initial branch."""
+    return Repo.init(path, initial_branch="main")
 
 
 def verify_yaml_output(result: str) -> dict[str, Any] | None:
     """Verify a string is valid YAML and return the parsed result."""
     try:
-        parsed_yaml = yaml.safe_load(result)
+        parsed_yaml = yaml.load(result, Loader=YamlLoader)
         assert parsed_yaml is not None, "YAML should parse to a valid structure"
         assert isinstance(parsed_yaml, dict), "Root should be a dictionary"
         return parsed_yaml
@@ -53,11 +98,55 @@ def verify_yaml_output(result: str) -> dict[str, Any] | None:
         return None
 
 
+def yaml_entry_names(parsed: Any) -> Iterator[str]:
+    """Yield every directory key and file name in parsed YAML output."""
+    if isinstance(parsed, dict):
+        for key, value in parsed.items():
+            yield key
+            yield from yaml_entry_names(value)
+    elif isinstance(parsed, list):
+        for item in parsed:
+            yield from yaml_entry_names(item)
+    else:
+        yield parsed
+
+
 def get_indentation_level(line: str) -> int:
     """Get the indentation level of a line by counting leading whitespace."""
     return len(line) - len(line.lstrip())
 
 
+NODE_NAME_PATTERN = re.compile(r"\b(root|dir1|level[123]|file[12]|nested[12]|deep_file)\b")
+
+
+def node_indents(result: str) -> dict[str, int]:
+    """Map each known node name in the output to the indentation level of its line."""
+    return {
+        match.group(1): get_indentation_level(line)
+        for line in result.splitlines()
+        if (match := NODE_NAME_PATTERN.search(line))
+    }
+
+
+MAIN_DEFAULTS: dict[str, Any] = {
+    "repo_paths": None,
+    "output": None,
+    "output_format": OutputFormat.YAML,
+    "verbose": False,
+    "exclude": None,
+    "others": False,
+    "stage": False,
+    "cached": True,
+    "exclude_standard": False,
+    "repo_as_root": True,
+}
+
+
+def run_main(**overrides: Any) -> None:
+    """Call main with MAIN_DEFAULTS, replaced by any keyword arguments given."""
+    main(**(MAIN_DEFAULTS | overrides))
+
+
 class TestPathNodeFormatter:
     def test_format_file(self) -> None:
         """Test formatting a file node (no trailing slash)."""
@@ -69,174 +158,147 @@ class TestPathNodeFormatter:
         result = path_node_formatter(node)
         assert result == "test_file.txt"
 
-    def test_format_directory(self, mock_path_is_dir) -> None:
+    def test_format_directory(self) -> None:
         """Test formatting a directory node (with trailing slash)."""
-        with pytest.MonkeyPatch.context() as mp:
-            # Use fixture to mock Path.is_dir to identify our test path as a directory
-            mock_is_dir = mock_path_is_dir({"test_dir"})
-            mp.setattr(Path, "is_dir", mock_is_dir)
+        fake_path = fake_path_cls({"test_dir"})
+
+        # Create a node with a Path object representing a directory
+        tree: Tree[Path] = Tree("Test Tree")
+        node = tree.add(fake_path("test_dir"))
 
-            # Create a node with a Path object representing a directory
-            tree: Tree[Path] = Tree("Test Tree")
-            node = tree.add(Path("test_dir"))
+        # Format the node and verify it has a trailing slash
+        result = path_node_formatter(node)
+        assert result == "test_dir/"
 
-            # Format the node and verify it has a trailing slash
-            result = path_node_formatter(node)
-            assert result == "test_dir/"
+    def test_format_uses_is_dir_meta(self) -> None:
+        """Test that the recorded is_dir meta value takes precedence over the filesystem."""
+        tree: Tree[Path] = Tree("Test Tree")
+        node = tree.add(Path("not_on_disk"))
+        node.set_meta("is_dir", True)
 
+        assert path_node_formatter(node) == "not_on_disk/"
 
-class TestGenerateYamlOutput:
-    def test_basic_yaml_conversion(self, mock_path_is_dir) -> None:
-        """Test basic tree to YAML conversion with properly mocked file paths."""
-        # Create a temp directory for proper Path objects with is_dir() behavior
+    def test_format_stats_node_once(self) -> None:
+        """Test that a node without is_dir meta is only checked on the filesystem once."""
+        calls: list[Path] = []
+
+        def _counting_is_dir(self: Path) -> bool:
+            calls.append(self)
+            return True
+
+        tree: Tree[Path] = Tree("Test Tree")
+        node = tree.add(Path("dir"))
         with pytest.MonkeyPatch.context() as mp:
-            # Mock the is_dir method to return True for directories and False for files
-            mock_is_dir = mock_path_is_dir({"root", "dir1"})
-            mp.setattr(Path, "is_dir", mock_is_dir)
-
-            # Create a tree with paths that will have proper is_dir behavior
-            tree = Tree[Path]("Test Tree")
-            root = tree.add(Path("root"))  # Will be treated as a directory
-            root.add(Path("file1.txt"))  # Will be treated as a file
-            root.add(Path("file2.md"))  # Will be treated as a file
-
-            # Convert to YAML string
-            result = generate_yaml_output(tree)
-
-            # Print actual result for debugging
-
-            # Verify basic content presence
-            assert isinstance(result, str)
-            assert "root" in result, "Root node missing"
-            assert "file1.txt" in result, "file1.txt missing"
-            assert "file2.md" in result, "file2.md missing"
-
-            # Verify and parse YAML
-            parsed_yaml = verify_yaml_output(result)
-            if parsed_yaml:
-                # Extract and verify structure
-                root_key = next(iter(parsed_yaml))
-                assert "root" in root_key, f"Expected 'root' in root key, got {root_key!r}"
-
-                # Check for files in the YAML structure
-                files = str(parsed_yaml[root_key])
-                assert "file1.txt" in files, "file1.txt missing from parsed YAML"
-                assert "file2.md" in files, "file2.md missing from parsed YAML"
-
-            # Check proper indentation structure in the output
-            lines = [line.rstrip() for line in result.strip().split("\n")]
-
-            # Find root line and file lines
-            root_line = next((line for line in lines if "root" in line), None)
-            file_lines = [line for line in lines if "file1" in line or "file2" in line]
-
-            # Verify proper indentation structure
-            assert root_line is not None, "Root line missing"
-            assert file_lines, "File lines missing"
-
-            # Files should be indented more than root
-            root_indent = len(root_line) - len(root_line.lstrip())
-            for file_line in file_lines:
-                file_indent = len(file_line) - len(file_line.lstrip())
-                assert file_indent > root_indent, f"File {file_line} not properly indented relative to root"
-
-    def test_nested_yaml_structure(self, mock_path_is_dir) -> None:
+            mp.setattr(Path, "is_dir", _counting_is_dir)
+            assert path_node_formatter(node) == "dir/"
+            assert generate_yaml_output(tree) == "dir/:"
+
+        assert calls == [Path("dir")]
+
+
+class TestGenerateYamlOutput:
+    def test_basic_yaml_conversion(self, basic_yaml) -> None:
+        """Test basic tree to YAML conversion produces the expected keys."""
+        result = basic_yaml
+
+        # Verify basic content presence
+        assert isinstance(result, str)
+        assert "root" in result, "Root node missing"
+        assert "file1.txt" in result, "file1.txt missing"
+        assert "file2.md" in result, "file2.md missing"
+
+        # Verify and parse YAML
+        parsed_yaml = verify_yaml_output(result)
+        if parsed_yaml:
+            # Extract and verify structure
+            root_key = next(iter(parsed_yaml))
+            assert "root" in root_key, f"Expected 'root' in root key, got {root_key!r}"
+
+            # Check for files in the YAML structure
+            files = str(parsed_yaml[root_key])
+            assert "file1.txt" in files, "file1.txt missing from parsed YAML"
+            assert "file2.md" in files, "file2.md missing from parsed YAML"
+
+    def test_basic_yaml_indentation(self, basic_yaml) -> None:
+        """Test basic tree to YAML conversion indents files below their directory."""
+        indents = node_indents(basic_yaml)
+
+        # Verify proper indentation structure
+        assert "root" in indents, "Root line missing"
+        assert "file1" in indents, "file1 line missing"
+        assert "file2" in indents, "file2 line missing"
+
+        # Files should be indented more than root
+        for name in ("file1", "file2"):
+            assert indents[name] > indents["root"], f"File {name} not properly indented relative to root"
+
+    def test_nested_yaml_structure(self) -> None:
         """Test conversion of nested structures to YAML."""
-        # Create a tree with nested structure using mocked Path objects
-        with pytest.MonkeyPatch.context() as mp:
-            # Mock is_dir to identify directories correctly
-            mock_is_dir = mock_path_is_dir({"root", "dir1", "level1", "level2", "level3"})
-            mp.setattr(Path, "is_dir", mock_is_dir)
-
-            # Create tree with nested structure
-            tree = Tree[Path]("Test Tree")
-            root = tree.add(Path("root"))  # Directory
-            dir1 = root.add(Path("dir1"))  # Directory
-            dir1.add(Path("nested1.txt"))  # File
-            dir1.add(Path("nested2.txt"))  # File
-
-            # Convert to YAML string
-            result = generate_yaml_output(tree)
-
-            # Verify we have valid YAML output
-            parsed_yaml = verify_yaml_output(result)
-            if parsed_yaml:
-                # Get root key and verify it exists
-                root_key = next(iter(parsed_yaml))
-                root_value = parsed_yaml[root_key]
-
-                # Verify hierarchy - dir1 should be a child of root with nested files
-                assert "dir1" in str(root_value), "dir1 directory missing from structure"
-                assert "nested1.txt" in str(root_value), "nested1.txt missing from structure"
-                assert "nested2.txt" in str(root_value), "nested2.txt missing from structure"
-
-            # Verify proper indentation structure
-            lines = [line.rstrip() for line in result.strip().split("\n")]
-
-            # Root line should come first, followed by dir1 and nested files
-            root_idx = next((i for i, line in enumerate(lines) if "root" in line), None)
-            dir1_idx = next((i for i, line in enumerate(lines) if "dir1" in line), None)
-            nested_indices = [i for i, line in enumerate(lines) if "nested" in line]
-
-            # Verify all lines are present
-            assert root_idx is not None, "Root line missing"
-            assert dir1_idx is not None, "dir1 line missing"
-            assert len(nested_indices) == 2, "Expected exactly 2 nested file entries"
-
-            # Verify proper indentation hierarchy
-            root_indent = get_indentation_level(lines[root_idx])
-            dir1_indent = get_indentation_level(lines[dir1_idx])
-
-            # dir1 should be indented more than root
-            assert dir1_indent > root_indent, "dir1 not properly indented relative to root"
-
-            # Nested files should be indented more than dir1
-            for idx in nested_indices:
-                nested_indent = get_indentation_level(lines[idx])
-                assert nested_indent > dir1_indent, "Nested file not properly indented relative to dir1"
-
-    def test_deep_nesting_indentation(self, mock_path_is_dir) -> None:
+        fake_path = fake_path_cls({"root", "dir1", "level1", "level2", "level3"})
+
+        # Create tree with nested structure
+        tree = Tree[Path]("Test Tree")
+        root = tree.add(fake_path("root"))  # Directory
+        dir1 = root.add(fake_path("dir1"))  # Directory
+        dir1.add(fake_path("nested1.txt"))  # File
+        dir1.add(fake_path("nested2.txt"))  # File
+
+        # Convert to YAML string
+        result = generate_yaml_output(tree)
+
+        # Verify we have valid YAML output
+        parsed_yaml = verify_yaml_output(result)
+        if parsed_yaml:
+            # Get root key and verify it exists
+            root_key = next(iter(parsed_yaml))
+            root_value = parsed_yaml[root_key]
+
+            # Verify hierarchy - dir1 should be a child of root with nested files
+            assert "dir1" in str(root_value), "dir1 directory missing from structure"
+            assert "nested1.txt" in str(root_value), "nested1.txt missing from structure"
+            assert "nested2.txt" in str(root_value), "nested2.txt missing from structure"
+
+        # Verify proper indentation structure
+        indents = node_indents(result)
+
+        # Verify all lines are present
+        for name in ("root", "dir1", "nested1", "nested2"):
+            assert name in indents, f"{name} line missing"
+
+        # dir1 should be indented more than root
+        assert indents["dir1"] > indents["root"], "dir1 not properly indented relative to root"
+
+        # Nested files should be indented more than dir1
+        for name in ("nested1", "nested2"):
+            assert indents[name] > indents["dir1"], "Nested file not properly indented relative to dir1"
+
+    def test_deep_nesting_indentation(self) -> None:
         """Test indentation with deeply nested directories."""
-        with pytest.MonkeyPatch.context() as mp:
-            # Mock is_dir to identify directories correctly
-            mock_is_dir = mock_path_is_dir({"root", "level1", "level2", "level3"})
-            mp.setattr(Path, "is_dir", mock_is_dir)
-
-            # Create a tree with multiple levels of nesting
-            tree = Tree[Path]("Test Tree")
-            root = tree.add(Path("root"))  # Directory
-            level1 = root.add(Path("level1"))  # Directory
-            level2 = level1.add(Path("level2"))  # Directory
-            level3 = level2.add(Path("level3"))  # Directory
-            level3.add(Path("deep_file.txt"))  # File
-
-            # Convert to YAML string
-            result = generate_yaml_output(tree)
-
-            # Verify the output is valid YAML
-            verify_yaml_output(result)
-
-            # Verify the nested structure
-            lines = [line.rstrip() for line in result.strip().split("\n")]
-
-            # Get indentation levels
-            indentation_levels = {}
-            for name in ["root", "level1", "level2", "level3", "deep_file"]:
-                line = next((line for line in lines if name in line), None)
-                assert line is not None, f"{name} missing from output"
-                indentation_levels[name] = get_indentation_level(line)
-
-            # Verify increasing indentation with depth
-            assert indentation_levels["level1"] > indentation_levels["root"], "level1 should be indented more than root"
-            assert indentation_levels["level2"] > indentation_levels["level1"], (
-                "level2 should be indented more than level1"
-            )
-            assert indentation_levels["level3"] > indentation_levels["level2"], (
-                "level3 should be indented more than level2"
-            )
-            assert indentation_levels["deep_file"] > indentation_levels["level3"], (
-                "deep_file should be indented more than level3"
-            )
+        fake_path = fake_path_cls({"root", "level1", "level2", "level3"})
+
+        # Create a tree with multiple levels of nesting
+        tree = Tree[Path]("Test Tree")
+        root = tree.add(fake_path("root"))  # Directory
+        level1 = root.add(fake_path("level1"))  # Directory
+        level2 = level1.add(fake_path("level2"))  # Directory
+        level3 = level2.add(fake_path("level3"))  # Directory
+        level3.add(fake_path("deep_file.txt"))  # File
+
+        # Convert to YAML string
+        result = generate_yaml_output(tree)
+
+        # Verify the output is valid YAML
+        verify_yaml_output(result)
+
+        # Verify the nested structure
+        indentation_levels = node_indents(result)
+        order = ["root", "level1", "level2", "level3", "deep_file"]
+        for name in order:
+            assert name in indentation_levels, f"{name} missing from output"
+
+        # Verify strictly increasing indentation with depth
+        levels = [indentation_levels[name] for name in order]
+        assert levels == sorted(set(levels)), f"Non-increasing indents: {dict(zip(order, levels, strict=True))}"
 
     def test_empty_tree_conversion(self) -> None:
         """Test conversion of an empty tree."""
@@ -250,169 +312,289 @@ class TestGenerateYamlOutput:
         assert result == ""
 
 
-class TestGitLsfilesToPathList:
-    """Tests for the git_lsfiles_to_path_list function."""
+class TestGitLsfilesToParts:
+    """Tests for the git_lsfiles_to_parts function."""
 
-    def test_successful_ls_files_returns_path_list(self, tmp_path) -> None:
-        """Test that successful git ls-files returns a list of paths."""
-        fake_repo = tmp_path / "repo"
-        fake_repo.mkdir()
-        mock_repo = MagicMock()
-        mock_repo.git_dir = str(fake_repo / ".git")
-        mock_repo.git.ls_files.return_value = "file1.txt\ndir/file2.py"
+    def test_successful_ls_files_returns_parts(self, tmp_path) -> None:
+        """Test that successful git ls-files yields the components of each path."""
+        repo = init_repo(tmp_path / "repo")
+        (tmp_path / "repo" / "dir").mkdir()
+        (tmp_path / "repo" / "file1.txt").write_bytes(b"content")
+        (tmp_path / "repo" / "dir" / "file2.py").write_bytes(b"content")
+        repo.index.add(["file1.txt", "dir/file2.py"])
 
-        result = git_lsfiles_to_path_list(mock_repo, "--cached")
+        result = list(git_lsfiles_to_parts(Path(repo.git_dir), Path(repo.working_dir), "--cached"))
 
-        assert len(result) == 2
-        assert result[0] == fake_repo / "file1.txt"
-        assert result[1] == fake_repo / "dir" / "file2.py"
+        assert result == [(("dir", "file2.py"), None), (("file1.txt",), None)]
 
     def test_ls_files_with_staged_output(self, tmp_path) -> None:
         """Test parsing staged output with mode/hash prefix."""
-        fake_repo = tmp_path / "repo"
-        fake_repo.mkdir()
-        mock_repo = MagicMock()
-        mock_repo.git_dir = str(fake_repo / ".git")
-        # Staged output format: mode hash stage\tfilename
-        mock_repo.git.ls_files.return_value = "100644 abc123 0\tfile1.txt\n100644 def456 0\tfile2.py"
+        repo = init_repo(tmp_path / "repo")
+        (tmp_path / "repo" / "file1.txt").write_bytes(b"content")
+        (tmp_path / "repo" / "tab\there.txt").write_bytes(b"content")
+        repo.index.add(["file1.txt", "tab\there.txt"])
+
+        result = list(git_lsfiles_to_parts(Path(repo.git_dir), Path(repo.working_dir), "--stage"))
 
-        result = git_lsfiles_to_path_list(mock_repo, "--stage")
+        assert result == [(("file1.txt",), 0o100644), (("tab\there.txt",), 0o100644)]
 
-        assert len(result) == 2
-        assert result[0] == fake_repo / "file1.txt"
-        assert result[1] == fake_repo / "file2.py"
+    def test_ls_files_staged_with_untracked_files(self, tmp_path) -> None:
+        """Test that untracked files mixed into staged output have no mode."""
+        repo = init_repo(tmp_path / "repo")
+        (tmp_path / "repo" / "tracked.txt").write_bytes(b"content")
+        (tmp_path / "repo" / "untracked.txt").write_bytes(b"content")
+        repo.index.add(["tracked.txt"])
+
+        result = list(git_lsfiles_to_parts(Path(repo.git_dir), Path(repo.working_dir), "--others", "--stage"))
+
+        assert sorted(result, key=str) == [(("tracked.txt",), 0o100644), (("untracked.txt",), None)]
+
+    def test_ls_files_with_special_characters(self, tmp_path) -> None:
+        """Test that names git would otherwise quote are returned verbatim."""
+        repo = init_repo(tmp_path / "repo")
+        names = ["with space.txt", "tab\there.txt", "caf\u00e9.txt"]
+        for name in names:
+            (tmp_path / "repo" / name).write_bytes(b"content")
+
+        result = list(git_lsfiles_to_parts(Path(repo.git_dir), Path(repo.working_dir), "--others"))
+
+        assert sorted(result) == sorted(((name,), None) for name in names)
 
     def test_git_command_failure_raises_exit(self, tmp_path) -> None:
         """Test that git command failure raises typer.Exit."""
-        fake_repo = tmp_path / "repo"
-        fake_repo.mkdir()
-        mock_repo = MagicMock()
-        mock_repo.git_dir = str(fake_repo / ".git")
-        mock_repo.git.ls_files.side_effect = Exception("Git command failed")
+        repo = init_repo(tmp_path / "repo")
 
         with pytest.raises(typer.Exit) as exc_info:
-            git_lsfiles_to_path_list(mock_repo, "--cached")
+            list(git_lsfiles_to_parts(Path(repo.git_dir), Path(repo.working_dir), "--no-such-option"))
 
         assert exc_info.value.exit_code == 1
 
+    def test_large_error_output_does_not_block(self, tmp_path, capsys) -> None:
+        """Test that git writing more than a pipe buffer to stderr still fails cleanly."""
+        repo = init_repo(tmp_path / "repo")
+        # One error line per unmatched pathspec, several hundred KiB in total
+        pathspecs = [f"missing-{i:05d}-{'x' * 100}" for i in range(2000)]
+
+        with pytest.raises(typer.Exit):
+            list(git_lsfiles_to_parts(Path(repo.git_dir), Path(repo.working_dir), "--error-unmatch", "--", *pathspecs))
+
+        assert "did not match any file(s)" in capsys.readouterr().err
+
+
+class TestLsFilesCache:
+    """Tests for the on-disk git ls-files listing cache."""
+
+    def test_cache_hit_skips_git(self, tmp_path, monkeypatch) -> None:
+        """Test that a cached listing is replayed without running git."""
+        repo = init_repo(tmp_path / "repo")
+        (tmp_path / "repo" / "file1.txt").write_bytes(b"content")
+        repo.index.add(["file1.txt"])
+
+        first = list(git_lsfiles_to_parts(Path(repo.git_dir), Path(repo.working_dir), "--cached", use_cache=True))
+        assert len(list((Path(repo.git_dir) / CACHE_DIR_NAME).iterdir())) == 1
+
+        def _fail(*args: Any, **kwargs: Any) -> None:
+            pytest.fail("git should not run on a cache hit")
+
+        monkeypatch.setattr(subprocess, "Popen", _fail)
+        assert (
+            list(git_lsfiles_to_parts(Path(repo.git_dir), Path(repo.working_dir), "--cached", use_cache=True))
+            == first
+            == [(("file1.txt",), None)]
+        )
+
+    def test_index_change_invalidates_cache(self, tmp_path) -> None:
+        """Test that updating the index produces a fresh listing and drops the stale entry."""
+        repo = init_repo(tmp_path / "repo")
+        (tmp_path / "repo" / "file1.txt").write_bytes(b"content")
+        repo.index.add(["file1.txt"])
+        list(git_lsfiles_to_parts(Path(repo.git_dir), Path(repo.working_dir), "--cached", use_cache=True))
+
+        (tmp_path / "repo" / "file2.txt").write_bytes(b"content")
+        repo.index.add(["file2.txt"])
+
+        result = list(git_lsfiles_to_parts(Path(repo.git_dir), Path(repo.working_dir), "--cached", use_cache=True))
+
+        assert result == [(("file1.txt",), None), (("file2.txt",), None)]
+        assert len(list((Path(repo.git_dir) / CACHE_DIR_NAME).iterdir())) == 1
+
+    def test_same_size_index_change_within_timestamp_invalidates_cache(self, tmp_path) -> None:
+        """Test that an index rewrite keeping the size and modification time is not served from the cache."""
+        repo = init_repo(tmp_path / "repo")
+        (tmp_path / "repo" / "a.txt").write_bytes(b"content")
+        repo.index.add(["a.txt"])
+        index_path = Path(repo.git_dir) / "index"
+        list(git_lsfiles_to_parts(Path(repo.git_dir), Path(repo.working_dir), "--cached", use_cache=True))
+        index_stat = index_path.stat()
+
+        repo.git.mv("a.txt", "b.txt")
+        os.utime(index_path, ns=(index_stat.st_atime_ns, index_stat.st_mtime_ns))
+        assert index_path.stat().st_size == index_stat.st_size
+
+        result = list(git_lsfiles_to_parts(Path(repo.git_dir), Path(repo.working_dir), "--cached", use_cache=True))
+
+        assert result == [(("b.txt",), None)]
+
+    def test_untracked_listing_is_not_cached(self, tmp_path) -> None:
+        """Test that listings including untracked files never use the cache."""
+        git_dir = tmp_path / "repo" / ".git"
+        git_dir.mkdir(parents=True)
+        (git_dir / "index").write_bytes(b"")
+
+        assert ls_files_cache_path(git_dir, git_dir.parent, ["--cached"]) is not None
+        assert ls_files_cache_path(git_dir, git_dir.parent, ["--others", "--cached"]) is None
+
 
 class TestAddPathToTree:
     """Tests for the add_path_to_tree function."""
 
-    def test_add_single_file_to_tree(self, mock_path_is_dir, tmp_path) -> None:
+    def test_add_single_file_to_tree(self) -> None:
         """Test adding a single file to an empty tree."""
-        with pytest.MonkeyPatch.context() as mp:
-            mock_is_dir = mock_path_is_dir({"root"})
-            mp.setattr(Path, "is_dir", mock_is_dir)
+        tree = Tree[Path]("Test Tree")
+        root = PurePosixPath("/root")
+        file_path = root / "file.txt"
 
-            tree = Tree[Path]("Test Tree")
-            root = tmp_path / "root"
-            file_path = tmp_path / "root" / "file.txt"
+        add_path_to_tree(tree, ("file.txt",), root, {})
 
-            add_path_to_tree(tree, file_path, root)
+        # Verify tree has the root and file
+        assert len(tree.children) == 1
+        root_node = tree.children[0]
+        assert root_node.data == root
+        assert len(root_node.children) == 1
+        assert root_node.children[0].data == file_path
 
-            # Verify tree has the root and file
-            assert len(tree.children) == 1
-            root_node = tree.children[0]
-            assert root_node.data == root
-            assert len(root_node.children) == 1
-            assert root_node.children[0].data == file_path
-
-    def test_add_nested_file_creates_intermediate_directories(self, mock_path_is_dir, tmp_path) -> None:
+    def test_add_nested_file_creates_intermediate_directories(self) -> None:
         """Test adding a deeply nested file creates intermediate nodes."""
-        with pytest.MonkeyPatch.context() as mp:
-            mock_is_dir = mock_path_is_dir({"root", "dir1", "dir2"})
-            mp.setattr(Path, "is_dir", mock_is_dir)
-
-            tree = Tree[Path]("Test Tree")
-            root = tmp_path / "root"
-            nested_file = tmp_path / "root" / "dir1" / "dir2" / "file.txt"
-
-            add_path_to_tree(tree, nested_file, root)
-
-            # Verify tree structure
-            root_node = tree.children[0]
-            assert root_node.data == root
-            dir1_node = root_node.children[0]
-            assert dir1_node.data == tmp_path / "root" / "dir1"
-            dir2_node = dir1_node.children[0]
-            assert dir2_node.data == tmp_path / "root" / "dir1" / "dir2"
-            file_node = dir2_node.children[0]
-            assert file_node.data == nested_file
-
-    def test_add_duplicate_path_does_not_create_duplicate(self, mock_path_is_dir, tmp_path) -> None:
+        tree = Tree[Path]("Test Tree")
+        root = PurePosixPath("/root")
+        nested_file = root / "dir1" / "dir2" / "file.txt"
+
+        add_path_to_tree(tree, ("dir1", "dir2", "file.txt"), root, {})
+
+        # Verify tree structure
+        root_node = tree.children[0]
+        assert root_node.data == root
+        dir1_node = root_node.children[0]
+        assert dir1_node.data == root / "dir1"
+        dir2_node = dir1_node.children[0]
+        assert dir2_node.data == root / "dir1" / "dir2"
+        file_node = dir2_node.children[0]
+        assert file_node.data == nested_file
+
+    def test_add_duplicate_path_does_not_create_duplicate(self) -> None:
         """Test adding the same path twice doesn't duplicate nodes."""
-        with pytest.MonkeyPatch.context() as mp:
-            mock_is_dir = mock_path_is_dir({"root"})
-            mp.setattr(Path, "is_dir", mock_is_dir)
+        tree = Tree[Path]("Test Tree")
+        root = PurePosixPath("/root")
 
-            tree = Tree[Path]("Test Tree")
-            root = tmp_path / "root"
-            file_path = tmp_path / "root" / "file.txt"
+        index: dict[tuple[str, ...], Node[Path]] = {}
+        add_path_to_tree(tree, ("file.txt",), root, index)
+        add_path_to_tree(tree, ("file.txt",), root, index)
 
-            add_path_to_tree(tree, file_path, root)
-            add_path_to_tree(tree, file_path, root)
+        # Should still have only one file
+        root_node = tree.children[0]
+        assert len(root_node.children) == 1
 
-            # Should still have only one file
-            root_node = tree.children[0]
-            assert len(root_node.children) == 1
+    def test_add_path_populates_index(self) -> None:
+        """Test that every created node is recorded in the index."""
+        tree = Tree[Path]("Test Tree")
+        root = PurePosixPath("/root")
+        index: dict[tuple[str, ...], Node[Path]] = {}
 
+        add_path_to_tree(tree, ("dir1", "file.txt"), root, index)
 
-class TestBuildLsFilesArgs:
-    """Tests for the build_ls_files_args function."""
+        assert set(index) == {(), ("dir1",), ("dir1", "file.txt")}
+        assert index[()].data == root
+        assert index["dir1", "file.txt"].data == root / "dir1" / "file.txt"
+        assert index["dir1", "file.txt"].parent is index["dir1",]
 
-    def test_build_args_with_others_flag(self, tmp_path) -> None:
-        """Test building args with --others flag."""
-        test_dir = tmp_path / "test"
-        test_dir.mkdir()
-        args = build_ls_files_args(
-            directory=test_dir, exclude=set(), others=True, stage=False, cached=False, exclude_standard=False
-        )
+    def test_add_path_records_is_dir(self) -> None:
+        """Test that intermediate nodes are marked as directories and the leaf as a file."""
+        tree = Tree[Path]("Test Tree")
+        root = PurePosixPath("/root")
+        index: dict[tuple[str, ...], Node[Path]] = {}
 
-        assert "--others" in args
-        assert "--stage" not in args
-        assert "--cached" not in args
-        assert "--recurse-submodules" not in args  # Not added when others=True
-        assert str(test_dir) in args
+        add_path_to_tree(tree, ("dir1", "file.txt"), root, index)
+        add_path_to_tree(tree, ("empty_dir",), root, index, is_dir=True)
 
-    def test_build_args_with_stage_flag(self, tmp_path) -> None:
-        """Test building args with --stage flag."""
-        test_dir = tmp_path / "test"
-        test_dir.mkdir()
-        args = build_ls_files_args(
-            directory=test_dir, exclude=set(), others=False, stage=True, cached=False, exclude_standard=False
-        )
+        assert index[()].get_meta("is_dir") is True
+        assert index["dir1",].get_meta("is_dir") is True
+        assert index["dir1", "file.txt"].get_meta("is_dir") is False
+        assert index["empty_dir",].get_meta("is_dir") is True
 
-        assert "--stage" in args
-        assert "--others" not in args
-        assert "--recurse-submodules" in args  # Added when others=False
 
-    def test_build_args_with_cached_flag(self, tmp_path) -> None:
-        """Test building args with --cached flag."""
-        test_dir = tmp_path / "test"
-        test_dir.mkdir()
-        args = build_ls_files_args(
-            directory=test_dir, exclude=set(), others=False, stage=False, cached=True, exclude_standard=False
-        )
+class TestIsDirOnDisk:
+    """Tests for the is_dir_on_disk function."""
+
+    def test_classifies_entries(self, tmp_path) -> None:
+        """Test that directories, files, missing paths and links are classified."""
+        (tmp_path / "pkg").mkdir()
+        (tmp_path / "pkg" / "module.py").write_bytes(b"")
+        (tmp_path / "link").symlink_to(tmp_path / "pkg")
+        listings: dict = {}
+
+        assert is_dir_on_disk(tmp_path, ("pkg",), listings)
+        assert not is_dir_on_disk(tmp_path, ("pkg", "module.py"), listings)
+        assert not is_dir_on_disk(tmp_path, ("missing.txt",), listings)
+        assert not is_dir_on_disk(tmp_path, ("gone", "file.txt"), listings)
+        assert not is_dir_on_disk(tmp_path, ("link",), listings)
+
+    def test_reads_each_directory_once(self, tmp_path, monkeypatch) -> None:
+        """Test that siblings are answered from a single directory read."""
+        for name in ("a", "b", "c"):
+            (tmp_path / name).mkdir()
+        scanned: list[str] = []
+        real_scandir = os.scandir
+
+        def _counting_scandir(path):
+            scanned.append(path)
+            return real_scandir(path)
+
+        monkeypatch.setattr(os, "scandir", _counting_scandir)
+        listings: dict = {}
 
-        assert "--cached" in args
+        assert all(is_dir_on_disk(tmp_path, (name,), listings) for name in ("a", "b", "c"))
+        assert len(scanned) == 1
 
-    def test_build_args_with_exclude_standard(self, tmp_path) -> None:
-        """Test building args with --exclude-standard flag."""
+
+class TestBuildLsFilesArgs:
+    """Tests for the build_ls_files_args function."""
+
+    @pytest.mark.parametrize(
+        ("flags", "present", "absent"),
+        [
+            ({"others": True}, {"--others"}, {"--stage", "--cached", "--recurse-submodules"}),
+            ({"stage": True}, {"--stage", "--recurse-submodules"}, {"--cached", "--others"}),
+            ({"cached": True}, {"--cached", "--recurse-submodules"}, {"--stage", "--others"}),
+            ({"others": True, "exclude_standard": True}, {"--others", "--exclude-standard"}, {"--recurse-submodules"}),
+        ],
+        ids=["others", "stage", "cached", "exclude_standard"],
+    )
+    def test_build_args_with_single_flag(self, flags: dict[str, bool], present: set[str], absent: set[str]) -> None:
+        """Test building args with each listing flag; --recurse-submodules is only added without --others."""
+        test_dir = Path("test")
+        kwargs = {"others": False, "stage": False, "cached": False, "exclude_standard": False} | flags
+        args = build_ls_files_args(directories=[test_dir], exclude=set(), **kwargs)
+
+        assert present <= set(args)
+        assert not absent & set(args)
+        assert args[-1] == str(test_dir)
+
+    def test_build_args_drops_exclude_standard_without_others(self, tmp_path) -> None:
+        """Test that --exclude-standard is only passed alongside --others."""
         test_dir = tmp_path / "test"
         test_dir.mkdir()
         args = build_ls_files_args(
-            directory=test_dir, exclude=set(), others=False, stage=False, cached=False, exclude_standard=True
+            directories=[test_dir], exclude=set(), others=False, stage=False, cached=True, exclude_standard=True
         )
 
-        assert "--exclude-standard" in args
+        assert "--exclude-standard" not in args
 
     def test_build_args_with_exclude_patterns(self, tmp_path) -> None:
         """Test building args with exclude patterns."""
         test_dir = tmp_path / "test"
         test_dir.mkdir()
         args = build_ls_files_args(
-            directory=test_dir,
+            directories=[test_dir],
             exclude={"*.pyc", "node_modules"},
             others=False,
             stage=False,
@@ -427,16 +609,34 @@ class TestBuildLsFilesArgs:
         test_dir = tmp_path / "test" / "dir"
         test_dir.mkdir(parents=True)
         args = build_ls_files_args(
-            directory=test_dir, exclude={"*.log"}, others=True, stage=True, cached=True, exclude_standard=True
+            directories=[test_dir], exclude={"*.log"}, others=True, stage=True, cached=True, exclude_standard=True
         )
 
         assert "--others" in args
         assert "--stage" in args
-        assert "--cached" in args
+        assert "--cached" not in args
         assert "--exclude-standard" in args
         assert "--exclude=*.log" in args
         assert str(test_dir) in args
 
+    def test_build_args_with_multiple_directories(self, tmp_path) -> None:
+        """Test that every directory is passed as a pathspec of a single call."""
+        dir1 = tmp_path / "dir1"
+        dir2 = tmp_path / "dir2"
+        args = build_ls_files_args(
+            directories=[dir1, dir2], exclude=set(), others=False, stage=False, cached=True, exclude_standard=False
+        )
+
+        assert args[-3:] == ["--", str(dir1), str(dir2)]
+
+    def test_build_args_sparse_only_with_index_listing(self, tmp_path) -> None:
+        """Test that --sparse is only passed when the index is listed."""
+        common = {"directories": [tmp_path], "exclude": set(), "exclude_standard": False, "sparse": True}
+
+        assert "--sparse" in build_ls_files_args(others=False, stage=False, cached=True, **common)
+        assert "--sparse" in build_ls_files_args(others=True, stage=True, cached=False, **common)
+        assert "--sparse" not in build_ls_files_args(others=True, stage=False, cached=False, **common)
+
 
 class TestIndentString:
     """Tests for the indent_string function."""
@@ -468,11 +668,8 @@ class TestValidateAndReturnRepo:
     def test_valid_repo_returns_repo_object(self, tmp_path) -> None:
         """Test that a valid git repo path returns a Repo object."""
         # Create a git repo
-        from git import Repo
-
         repo_path = tmp_path / "test_repo"
-        repo_path.mkdir()
-        Repo.init(repo_path)
+        init_repo(repo_path)
 
         result = validate_and_return_repo(repo_path)
 
@@ -587,7 +784,7 @@ class TestValidateDirectories:
     def test_file_path_raises_exit(self, tmp_path) -> None:
         """Test that a file path raises typer.Exit."""
         test_file = tmp_path / "file.txt"
-        test_file.write_text("content")
+        test_file.write_bytes(b"content")
 
         with pytest.raises(typer.Exit) as exc_info:
             validate_directories({test_file})
@@ -598,35 +795,19 @@ class TestValidateDirectories:
 class TestGenerateOutputContent:
     """Tests for the generate_output_content function."""
 
-    def test_yaml_format_returns_yaml(self, mock_path_is_dir) -> None:
+    def test_yaml_format_returns_yaml(self, basic_tree) -> None:
         """Test that YAML format generates YAML output."""
-        with pytest.MonkeyPatch.context() as mp:
-            mock_is_dir = mock_path_is_dir({"root"})
-            mp.setattr(Path, "is_dir", mock_is_dir)
+        result = generate_output_content(basic_tree, OutputFormat.YAML, {"--cached"})
 
-            tree = Tree[Path]("Test")
-            root = tree.add(Path("root"))
-            root.add(Path("file.txt"))
+        assert "root" in result
+        assert "file1.txt" in result
 
-            result = generate_output_content(tree, OutputFormat.YAML, {"--cached"})
-
-            assert "root" in result
-            assert "file.txt" in result
-
-    def test_tree_format_returns_tree(self, mock_path_is_dir) -> None:
+    def test_tree_format_returns_tree(self, basic_tree) -> None:
         """Test that TREE format generates tree output."""
-        with pytest.MonkeyPatch.context() as mp:
-            mock_is_dir = mock_path_is_dir({"root"})
-            mp.setattr(Path, "is_dir", mock_is_dir)
+        result = generate_output_content(basic_tree, OutputFormat.TREE, {"--cached"})
 
-            tree = Tree[Path]("Test")
-            root = tree.add(Path("root"))
-            root.add(Path("file.txt"))
-
-            result = generate_output_content(tree, OutputFormat.TREE, {"--cached"})
-
-            assert "root" in result
-            assert "file.txt" in result
+        assert "root" in result
+        assert "file1.txt" in result
 
     def test_empty_yaml_returns_message(self) -> None:
         """Test that empty YAML output returns informative message."""
@@ -636,305 +817,312 @@ class TestGenerateOutputContent:
 
         assert "Nothing found" in result or result == ""
 
+    def test_empty_tree_format_returns_empty_string(self) -> None:
+        """Test that an empty tree in tree format produces no output."""
+        assert generate_output_content(Tree[Path]("Empty"), OutputFormat.TREE, {"--others"}) == ""
 
-class TestBuildTreeFromGit:
-    """Tests for the build_tree_from_git function."""
 
-    def test_build_tree_with_files(self, tmp_path) -> None:
-        """Test building a tree from a git repository."""
-        from git import Repo
+class TestWriteOutputContent:
+    """Tests for the write_output_content function."""
 
-        # Create a git repo with a file
-        repo_path = tmp_path / "repo"
-        repo_path.mkdir()
-        repo = Repo.init(repo_path)
+    @pytest.mark.parametrize("output_format", [OutputFormat.YAML, OutputFormat.TREE])
+    def test_matches_generated_content(self, output_format) -> None:
+        """Test that the streamed output is the generated content with a final newline."""
+        fake_path = fake_path_cls({"root", "sub"})
 
-        test_file = repo_path / "test.txt"
-        test_file.write_text("content")
-        repo.index.add(["test.txt"])
-        repo.index.commit("Initial commit")
+        tree = Tree[Path]("Test")
+        root = tree.add(fake_path("root"))
+        root.add(fake_path("sub")).add(fake_path("nested.txt"))
+        root.add(fake_path("file.txt"))
+
+        stream = io.StringIO()
+        write_output_content(tree, output_format, {"--cached"}, stream)
+
+        assert stream.getvalue() == generate_output_content(tree, output_format, {"--cached"}) + "\n"
+
+    def test_empty_yaml_writes_message(self) -> None:
+        """Test that an empty tree writes the informative YAML comment."""
+        stream = io.StringIO()
+        write_output_content(Tree[Path]("Empty"), OutputFormat.YAML, {"--others"}, stream)
+
+        assert stream.getvalue().startswith("# Nothing found")
+
+    def test_empty_tree_writes_nothing(self) -> None:
+        """Test that an empty tree in tree format writes no output."""
+        stream = io.StringIO()
+        write_output_content(Tree[Path]("Empty"), OutputFormat.TREE, {"--others"}, stream)
+
+        assert stream.getvalue() == ""
+
+
+class TestOpenOutput:
+    """Tests for the open_output function."""
+
+    def test_writes_to_file(self, tmp_path) -> None:
+        """Test that the output file is created with what was written."""
+        output_file = tmp_path / "output.yaml"
+
+        with open_output(output_file) as f:
+            f.write("- file.txt\n")
+
+        assert output_file.read_text(encoding="utf-8") == "- file.txt\n"
+
+    def test_writes_to_stdout_file_descriptor(self, capfd) -> None:
+        """Test that standard output is written through its file descriptor and left open."""
+        with open_output(None) as f:
+            f.write("- caf\u00e9.txt\n")
+        print("after", flush=True)
+
+        assert not sys.stdout.closed
+        assert capfd.readouterr().out == "- caf\u00e9.txt\nafter\n"
+
+    def test_terminal_stdout_is_used_as_is(self, monkeypatch) -> None:
+        """Test that standard output attached to a terminal keeps its own line buffering."""
+        terminal = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        monkeypatch.setattr(terminal, "fileno", lambda: 1, raising=False)
+        monkeypatch.setattr(terminal, "isatty", lambda: True, raising=False)
+        monkeypatch.setattr(sys, "stdout", terminal)
+
+        with open_output(None) as f:
+            assert f is terminal
+
+
+class TestBuildTreeFromGit:
+    """Tests for the build_tree_from_git function."""
+
+    @pytest.mark.parametrize("exclude", [set(), {"*.log"}])
+    def test_build_tree_with_files(self, shared_repo, exclude: set[str]) -> None:
+        """Test building a tree from a git repository, with and without exclusion patterns."""
+        repo_path = Path(shared_repo.working_dir)
 
         tree = build_tree_from_git(
-            repo=repo,
+            repo=shared_repo,
             root_node=repo_path,
             directories={repo_path},
-            exclude=set(),
-            others=False,
+            exclude=exclude,
+            others=True,
             stage=False,
             cached=True,
             exclude_standard=False,
         )
 
-        assert tree is not None
-        # Tree should have content - use format() to get the full tree representation
-        tree_output = tree.format()
-        assert "test.txt" in tree_output
+        names = {node.data.name for node in tree}
+        # git only applies --exclude to untracked files: the tracked ignore.log stays, the untracked debug.log goes
+        assert {"test.txt", "keep.txt", "ignore.log"} <= names
+        assert ("debug.log" in names) == (not exclude)
+
+    def test_build_tree_marks_submodule_as_directory(self, tmp_path) -> None:
+        """Test that a submodule entry, listed without any files below it, is a directory."""
+        repo_path = tmp_path / "repo"
+        repo_path.mkdir()
+        repo = init_repo(repo_path)
+
+        (repo_path / "file.txt").write_bytes(b"content")
+        repo.index.add(["file.txt"])
+        (repo_path / "sub").mkdir()
+        repo.git.update_index("--add", "--cacheinfo", f"160000,{SUBMODULE_COMMIT},sub")
 
-    def test_build_tree_with_exclude_pattern(self, tmp_path) -> None:
-        """Test building a tree with exclusion patterns."""
-        from git import Repo
+        tree = build_tree_from_git(
+            repo=repo, root_node=repo_path, directories={repo_path}, others=True, stage=False, cached=True
+        )
 
+        is_dir = {node.data.name: node.get_meta("is_dir") for node in tree}
+        assert is_dir == {"repo": True, "file.txt": False, "sub": True}
+
+    def test_build_tree_uses_stage_mode_for_submodule(self, tmp_path) -> None:
+        """Test that a submodule listed with --stage is a directory even when it is not checked out."""
         repo_path = tmp_path / "repo"
         repo_path.mkdir()
-        repo = Repo.init(repo_path)
+        repo = init_repo(repo_path)
+
+        (repo_path / "file.txt").write_bytes(b"content")
+        repo.index.add(["file.txt"])
+        repo.git.update_index("--add", "--cacheinfo", f"160000,{SUBMODULE_COMMIT},sub")
 
-        # Create files
-        (repo_path / "keep.txt").write_text("keep")
-        (repo_path / "ignore.log").write_text("ignore")
-        repo.index.add(["keep.txt", "ignore.log"])
+        tree = build_tree_from_git(
+            repo=repo, root_node=repo_path, directories={repo_path}, others=True, stage=True, cached=False
+        )
+
+        is_dir = {node.data.name: node.get_meta("is_dir") for node in tree}
+        assert is_dir == {"repo": True, "file.txt": False, "sub": True}
+
+    @pytest.mark.skipif(Git().version_info < (2, 35), reason="git ls-files --sparse needs Git 2.35 or newer")
+    @pytest.mark.parametrize(("stage", "cached"), [(True, False), (False, True)])
+    def test_build_tree_lists_sparse_directory_once(self, tmp_path, stage, cached) -> None:
+        """Test that a directory outside a sparse-index checkout is a single directory node."""
+        repo_path = tmp_path / "repo"
+        (repo_path / "inside").mkdir(parents=True)
+        (repo_path / "outside").mkdir()
+        repo = init_repo(repo_path)
+
+        (repo_path / "inside" / "kept.txt").write_bytes(b"content")
+        (repo_path / "outside" / "hidden.txt").write_bytes(b"content")
+        # Staged with git itself: sparse-checkout only collapses directories whose index stat data is up to date
+        repo.git.add("inside/kept.txt", "outside/hidden.txt")
         repo.index.commit("Initial commit")
+        repo.git.sparse_checkout("set", "--cone", "--sparse-index", "inside")
 
         tree = build_tree_from_git(
             repo=repo,
             root_node=repo_path,
             directories={repo_path},
-            exclude={"*.log"},
             others=False,
-            stage=False,
-            cached=True,
-            exclude_standard=False,
+            stage=stage,
+            cached=cached,
+            sparse=True,
         )
 
-        tree_output = tree.format()
-        assert "keep.txt" in tree_output
-
+        is_dir = {node.data.name: node.get_meta("is_dir") for node in tree}
+        assert is_dir == {"repo": True, "inside": True, "kept.txt": False, "outside": True}
 
-class TestMainFunction:
-    """Tests for the main CLI function."""
-
-    def test_main_with_valid_repo_yaml_output(self, tmp_path) -> None:
-        """Test main function with valid repo and YAML output."""
-        from git import Repo
-
-        # Create a git repo
+    def test_build_tree_sorts_entries_by_name(self, tmp_path) -> None:
+        """Test that tracked and untracked entries are interleaved in name order."""
         repo_path = tmp_path / "repo"
-        repo_path.mkdir()
-        repo = Repo.init(repo_path)
-
-        test_file = repo_path / "test.txt"
-        test_file.write_text("content")
-        repo.index.add(["test.txt"])
-        repo.index.commit("Initial commit")
+        (repo_path / "b_dir").mkdir(parents=True)
+        repo = init_repo(repo_path)
 
-        output_file = tmp_path / "output.yaml"
+        for name in ("c.txt", "a.txt", "b_dir/z.txt"):
+            (repo_path / name).write_bytes(b"content")
+        repo.index.add(["c.txt", "b_dir/z.txt"])
+        (repo_path / "b_dir" / "y.txt").write_bytes(b"untracked")
 
-        # Change to repo directory and run main
-        import os
-
-        original_cwd = os.getcwd()
-        try:
-            os.chdir(repo_path)
-            main(
-                repo_paths=None,
-                repo_path=repo_path,
-                output=output_file,
-                output_format=OutputFormat.YAML,
-                verbose=False,
-                exclude=None,
-                others=False,
-                stage=False,
-                cached=True,
-                exclude_standard=False,
-                repo_as_root=True,
-            )
-        finally:
-            os.chdir(original_cwd)
+        tree = build_tree_from_git(
+            repo=repo, root_node=repo_path, directories={repo_path}, others=True, stage=True, cached=False
+        )
 
-        assert output_file.exists()
-        content = output_file.read_text()
-        assert "test.txt" in content
+        assert [node.data.name for node in tree] == ["repo", "a.txt", "b_dir", "y.txt", "z.txt", "c.txt"]
 
-    def test_main_with_tree_format(self, tmp_path) -> None:
-        """Test main function with tree format output."""
-        from git import Repo
 
-        repo_path = tmp_path / "repo"
-        repo_path.mkdir()
-        repo = Repo.init(repo_path)
+class TestMainFunction:
+    """Tests for the main CLI function."""
 
-        test_file = repo_path / "test.txt"
-        test_file.write_text("content")
-        repo.index.add(["test.txt"])
-        repo.index.commit("Initial commit")
+    @pytest.mark.parametrize(
+        ("output_format", "verbose", "ext"),
+        [(OutputFormat.YAML, False, "yaml"), (OutputFormat.TREE, False, "txt"), (OutputFormat.YAML, True, "yaml")],
+    )
+    def test_main_output_variants(
+        self, sample_repo, tmp_path, output_format: OutputFormat, verbose: bool, ext: str
+    ) -> None:
+        """Test main function writes the staged file for each output format and verbosity."""
+        repo_path = Path(sample_repo.working_dir)
+        output_file = tmp_path / f"output.{ext}"
 
-        output_file = tmp_path / "output.txt"
-
-        import os
-
-        original_cwd = os.getcwd()
-        try:
-            os.chdir(repo_path)
-            main(
-                repo_paths=None,
-                repo_path=repo_path,
-                output=output_file,
-                output_format=OutputFormat.TREE,
-                verbose=False,
-                exclude=None,
-                others=False,
-                stage=False,
-                cached=True,
-                exclude_standard=False,
-                repo_as_root=True,
-            )
-        finally:
-            os.chdir(original_cwd)
+        run_main(repo_path=repo_path, output=output_file, output_format=output_format, verbose=verbose)
 
         assert output_file.exists()
+        assert "test.txt" in output_file.read_text()
+
+    @pytest.mark.parametrize(
+        ("repo_paths", "output_name", "exclude", "expected", "unexpected"),
+        [
+            # git ls-files only applies --exclude to untracked files, so only debug.log is dropped
+            (None, "output.yaml", ["*.log"], "keep.txt", "debug.log"),
+            (["subdir"], "output.yaml", None, "file.txt", "hello.txt"),
+            (None, None, None, "hello.txt", None),
+        ],
+        ids=["exclude_patterns", "repo_paths", "without_output_file"],
+    )
+    def test_main_options(
+        self,
+        sample_repo,
+        tmp_path,
+        capsys,
+        repo_paths: list[str] | None,
+        output_name: str | None,
+        exclude: list[str] | None,
+        expected: str,
+        unexpected: str | None,
+    ) -> None:
+        """Test main function with exclude patterns, specific repo paths and without an output file."""
+        repo_path = Path(sample_repo.working_dir)
+        output_file = tmp_path / output_name if output_name else None
+
+        run_main(
+            repo_paths=[repo_path / path for path in repo_paths] if repo_paths else None,
+            repo_path=repo_path,
+            output=output_file,
+            exclude=exclude,
+            others=True,
+        )
 
-    def test_main_with_verbose_mode(self, tmp_path) -> None:
-        """Test main function with verbose mode enabled completes successfully."""
-        from git import Repo
+        content = output_file.read_text() if output_file else capsys.readouterr().out
+        names = set(yaml_entry_names(verify_yaml_output(content)))
+        assert expected in names
+        assert unexpected not in names
 
+    @pytest.mark.parametrize(("stage", "cached"), [(True, False), (False, True)])
+    def test_main_with_exclude_binaries(self, tmp_path, capsys, stage: bool, cached: bool) -> None:
+        """Test that --exclude-binaries drops tracked and untracked files with binary extensions."""
         repo_path = tmp_path / "repo"
         repo_path.mkdir()
-        repo = Repo.init(repo_path)
+        repo = init_repo(repo_path)
 
-        test_file = repo_path / "test.txt"
-        test_file.write_text("content")
-        repo.index.add(["test.txt"])
-        repo.index.commit("Initial commit")
+        (repo_path / "notes.txt").write_bytes(b"text")
+        (repo_path / "logo.png").write_bytes(b"\x89PNG")
+        (repo_path / "tracked.txt").write_bytes(b"text")
+        (repo_path / "libtracked.so").write_bytes(b"\x7fELF")
+        repo.index.add(["tracked.txt", "libtracked.so"])
 
-        output_file = tmp_path / "output.yaml"
+        run_main(
+            repo_path=repo_path, exclude_binaries=True, others=True, stage=stage, cached=cached, exclude_standard=True
+        )
 
-        import os
-
-        original_cwd = os.getcwd()
-        try:
-            os.chdir(repo_path)
-            # Verbose mode should complete without error
-            main(
-                repo_paths=None,
-                repo_path=repo_path,
-                output=output_file,
-                output_format=OutputFormat.YAML,
-                verbose=True,
-                exclude=None,
-                others=False,
-                stage=False,
-                cached=True,
-                exclude_standard=False,
-                repo_as_root=True,
-            )
-        finally:
-            os.chdir(original_cwd)
-
-        # Verify output file was created with content
-        assert output_file.exists()
-        content = output_file.read_text()
-        assert "test.txt" in content
+        output = capsys.readouterr().out
+        assert "notes.txt" in output
+        assert "tracked.txt" in output
+        assert "logo.png" not in output
+        assert "libtracked.so" not in output
 
-    def test_main_with_exclude_patterns(self, tmp_path) -> None:
-        """Test main function with exclude patterns."""
-        from git import Repo
+    def test_main_replays_cached_tracked_listing(self, sample_repo, monkeypatch) -> None:
+        """Test that a second tracked-only CLI run is answered from the ls-files cache without running git."""
+        args = ["--repo", sample_repo.working_dir, "--no-others", "--cached"]
+        first = CliRunner().invoke(app, args)
+        assert first.exit_code == 0, first.output
+        assert (Path(sample_repo.git_dir) / CACHE_DIR_NAME).is_dir()
 
-        repo_path = tmp_path / "repo"
-        repo_path.mkdir()
-        repo = Repo.init(repo_path)
+        def _fail(*args: Any, **kwargs: Any) -> None:
+            pytest.fail("git ls-files should not run on a cache hit")
 
-        (repo_path / "keep.txt").write_text("keep")
-        (repo_path / "ignore.log").write_text("ignore")
-        repo.index.add(["keep.txt", "ignore.log"])
-        repo.index.commit("Initial commit")
+        monkeypatch.setattr(subprocess, "Popen", _fail)
+        second = CliRunner().invoke(app, args)
 
-        output_file = tmp_path / "output.yaml"
+        assert second.exit_code == 0, second.output
+        assert second.output == first.output
+        assert "keep.txt" in second.output
 
-        import os
-
-        original_cwd = os.getcwd()
-        try:
-            os.chdir(repo_path)
-            main(
-                repo_paths=None,
-                repo_path=repo_path,
-                output=output_file,
-                output_format=OutputFormat.YAML,
-                verbose=False,
-                exclude=["*.log"],
-                others=False,
-                stage=False,
-                cached=True,
-                exclude_standard=False,
-                repo_as_root=True,
-            )
-        finally:
-            os.chdir(original_cwd)
-
-        content = output_file.read_text()
-        assert "keep.txt" in content
-
-    def test_main_with_repo_paths(self, tmp_path) -> None:
-        """Test main function with specific repo paths."""
-        from git import Repo
+    def test_main_stops_quietly_on_broken_pipe(self, sample_repo, monkeypatch, caplog, capsys) -> None:
+        """Test that a reader closing the pipe early ends main without logging an error."""
 
-        repo_path = tmp_path / "repo"
-        repo_path.mkdir()
-        subdir = repo_path / "subdir"
-        subdir.mkdir()
-        repo = Repo.init(repo_path)
+        def _broken_pipe(*args: Any) -> None:
+            raise BrokenPipeError
 
-        (subdir / "file.txt").write_text("content")
-        repo.index.add(["subdir/file.txt"])
-        repo.index.commit("Initial commit")
+        # capsys leaves sys.stdout without a file descriptor, so main does not redirect pytest's own
+        monkeypatch.setattr("git_tree_project_structure_to_yaml._cli.write_output_content", _broken_pipe)
 
-        output_file = tmp_path / "output.yaml"
+        with pytest.raises(typer.Exit) as exc_info:
+            run_main(repo_path=Path(sample_repo.working_dir))
 
-        import os
-
-        original_cwd = os.getcwd()
-        try:
-            os.chdir(repo_path)
-            main(
-                repo_paths=[subdir],
-                repo_path=repo_path,
-                output=output_file,
-                output_format=OutputFormat.YAML,
-                verbose=False,
-                exclude=None,
-                others=False,
-                stage=False,
-                cached=True,
-                exclude_standard=False,
-                repo_as_root=True,
-            )
-        finally:
-            os.chdir(original_cwd)
+        assert exc_info.value.exit_code == 1
+        assert "An error occurred" not in caplog.text
 
-        assert output_file.exists()
+    def test_cli_import_defers_heavy_dependencies(self) -> None:
+        """Test that importing the CLI module does not load GitPython or nutree."""
+        code = (
+            "import sys, git_tree_project_structure_to_yaml._cli; print('git' in sys.modules, 'nutree' in sys.modules)"
+        )
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
 
-    def test_main_without_output_file_completes_successfully(self, tmp_path) -> None:
-        """Test main function completes without error when no output file specified."""
-        from git import Repo
+        assert result.stdout.split() == ["False", "False"]
 
+    def test_main_without_output_file_writes_to_stdout(self, tmp_path, capsys) -> None:
+        """Test main function prints the output when no output file is specified."""
         repo_path = tmp_path / "repo"
         repo_path.mkdir()
-        repo = Repo.init(repo_path)
+        repo = init_repo(repo_path)
 
-        test_file = repo_path / "hello.txt"
-        test_file.write_text("world")
+        (repo_path / "hello.txt").write_bytes(b"world")
         repo.index.add(["hello.txt"])
-        repo.index.commit("Initial commit")
 
-        import os
-
-        original_cwd = os.getcwd()
-        try:
-            os.chdir(repo_path)
-            # Should complete without raising an exception
-            main(
-                repo_paths=None,
-                repo_path=repo_path,
-                output=None,
-                output_format=OutputFormat.YAML,
-                verbose=False,
-                exclude=None,
-                others=False,
-                stage=False,
-                cached=True,
-                exclude_standard=False,
-                repo_as_root=True,
-            )
-        finally:
-            os.chdir(original_cwd)
-
-        # Function completed successfully without an output file
+        run_main(repo_path=repo_path)
+
+        assert capsys.readouterr().out == "repo/:\n  - hello.txt\n"
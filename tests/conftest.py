@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import os
+import shutil
+import stat
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+from git import Repo
+
+# Files in the git directory that git or GitPython rewrite, so sample_repo copies instead of linking them
+MUTABLE_GIT_FILES = ("index", "HEAD", "config")
+
+# Write permission bits removed from the template's files so in-place writes through a hard link fail
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+SAMPLE_FILES = ("test.txt", "keep.txt", "ignore.log", "hello.txt", "subdir/file.txt")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def isolated_git_config() -> Iterator[None]:
+    """Keep git from reading the user's global and system configuration during the tests.
+
+    That configuration can enable hooks, commit signing or init templates that
+    make every test repository slower to create, so git only reads each
+    repository's own config. The environment is restored after the session.
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("GIT_CONFIG_GLOBAL", os.devnull)
+        mp.setenv("GIT_CONFIG_NOSYSTEM", "1")
+        yield
+
+
+@pytest.fixture(scope="session")
+def sample_repo_template(tmp_path_factory) -> Path:
+    """Create a git repository with the SAMPLE_FILES staged and an untracked debug.log once per test session.
+
+    tmp_path_factory gives every pytest-xdist worker its own base directory, so
+    parallel workers each build their own template without colliding. Its files
+    are made read-only because sample_repo hard-links them into every copy.
+    """
+    repo_path = tmp_path_factory.mktemp("sample_repo") / "repo"
+    repo_path.mkdir()
+    repo = Repo.init(repo_path, initial_branch="main")
+
+    (repo_path / "subdir").mkdir()
+    for name in SAMPLE_FILES:
+        (repo_path / name).write_bytes(b"content")
+    # Listing tracked files only reads the index, so no commit is needed
+    repo.index.add(list(SAMPLE_FILES))
+    (repo_path / "debug.log").write_bytes(b"untracked")
+    repo.close()
+
+    for directory, _, files in os.walk(repo_path):
+        for name in files:
+            file_path = Path(directory, name)
+            file_path.chmod(file_path.stat().st_mode & ~WRITE_BITS)
+    return repo_path
+
+
+@pytest.fixture(scope="session")
+def shared_repo(sample_repo_template) -> Repo:
+    """Open the sample repository itself for tests that only read from it."""
+    return Repo(sample_repo_template)
+
+
+@pytest.fixture
+def sample_repo(sample_repo_template, tmp_path) -> Repo:
+    """Copy the sample repository to tmp_path / "repo" so each test can modify its own.
+
+    Files are read-only hard links to the template, so tests may add files but
+    writing to an existing one fails. The MUTABLE_GIT_FILES are writable copies.
+    """
+    repo_path = tmp_path / "repo"
+    shutil.copytree(sample_repo_template, repo_path, symlinks=True, copy_function=os.link)
+    for name in MUTABLE_GIT_FILES:
+        copy_path = repo_path / ".git" / name
+        copy_path.unlink()
+        shutil.copy2(sample_repo_template / ".git" / name, copy_path)
+        copy_path.chmod(copy_path.stat().st_mode | stat.S_IWUSR)
+    return Repo(repo_path)